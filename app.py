@@ -1,18 +1,152 @@
 import streamlit as st
-import pandas as pd
-from google import genai
 import os
 from dotenv import load_dotenv
-import chromadb
-import uuid
+import time
+import hashlib
+import sqlite3
+import threading
+import json
+import re
+import random
+import shutil
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import urllib.parse
+import weakref
+import io
+import importlib.util
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access and takes its place.
+    
+    Unlike importlib's LazyLoader nothing is registered in sys.modules up front, so scans of
+    sys.modules (Streamlit runs one on its first render) don't trigger the import either.
+    """
+    
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+    
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+pd = LazyModule("pandas", "pd")
+np = LazyModule("numpy", "np")
+chromadb = LazyModule("chromadb", "chromadb")
+genai = LazyModule("google.genai", "genai")
+feather = LazyModule("pyarrow.feather", "feather")
 
 # Load environment variables
 load_dotenv()
 
+# Gemini models
+GENERATION_MODEL = "gemini-2.0-flash"
+
+# Embedding pipeline settings
+EMBEDDING_MODEL = "gemini-embedding-001"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "5000"))
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))  # background ingests running at once
+INDEXING_REFRESH_SECONDS = 1
+
+# Gemini request limits: per-model quota in requests per minute, shared by every session in the process
+GEMINI_RPM = {
+    GENERATION_MODEL: int(os.getenv("GEMINI_GENERATION_RPM", "1000")),
+    EMBEDDING_MODEL: int(os.getenv("GEMINI_EMBEDDING_RPM", "1500")),
+}
+GEMINI_DEFAULT_RPM = int(os.getenv("GEMINI_DEFAULT_RPM", "60"))  # models not listed above
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))  # per-model ceiling for in-flight requests
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "120"))  # queueing, retries and backoff included
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))  # a single HTTP request
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 20
+
+# Workbook parsing: "calamine" is used when python-calamine is installed, else pandas' default
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "calamine" if importlib.util.find_spec("python_calamine") else "")
+LEAD_LOG_SHEET = 'Daily Lead Log'
+
+# Parsed trackers are kept as memory-mapped Arrow files when pyarrow is installed; CRM_SNAPSHOTS=0 turns this off
+SNAPSHOTS_ENABLED = os.getenv("CRM_SNAPSHOTS", "1") != "0" and importlib.util.find_spec("pyarrow") is not None
+SNAPSHOT_CACHE_MAX_MB = int(os.getenv("SNAPSHOT_CACHE_MAX_MB", "2048"))
+
+# Lead log columns converted once at load time
+CATEGORICAL_COLUMNS = ['Sales Rep', 'Status Stage', 'Source', 'Priority', 'Action Taken', 'Next Step']
+DATE_COLUMNS = ['Action Date', 'Last Contact Date', 'Due Date']
+
+# Pipeline stages counted as active on the dashboard
+ACTIVE_STAGES = ['New', 'Contacted', 'Engaged', 'Proposal Sent']
+
+# Lead scoring: each signal is scaled to 0-1 and weighted; closed leads score zero
+LEAD_SCORE_WEIGHTS = {'overdue': 3.0, 'staleness': 1.5, 'deal_value': 2.0, 'priority': 2.0, 'stage': 1.5}
+PRIORITY_LEVELS = {'High': 1.0, 'Medium': 0.6, 'Low': 0.3}
+STAGE_LEVELS = {'New': 0.25, 'Contacted': 0.5, 'Engaged': 0.75, 'Proposal Sent': 1.0}
+SCORE_HORIZON_DAYS = 30  # overdue and staleness stop adding urgency past this many days
+PRIORITIES_TOP_N = int(os.getenv("PRIORITIES_TOP_N", "25"))
+
+# Dashboard rollups: counters per rep, source and stage, kept current by row deltas
+ROLLUP_DIMENSIONS = ['Sales Rep', 'Source', 'Status Stage']
+ROLLUP_MEASURES = ['Total Leads', 'Active Leads', 'Closed Won', 'Calls Made', 'Proposals Sent', 'Meetings Booked',
+                   'Pipeline Value', 'Won Value']
+
+# Manager report counts, kept per rep and day so any date range is a prefix-sum difference
+REPORT_MEASURES = ['Activities', 'New Leads', 'Calls', 'Proposals', 'Deals Closed', 'Contacted', 'Qualified']
+
+# Case-insensitive patterns that classify 'Action Taken' into activity types
+ACTIVITY_RULES = {
+    'connection': 'connection|connect|initial',
+    'call': 'call|phone|discussion',
+    'proposal': 'proposal|quote|estimate',
+    'closed': 'closed|won|signed',
+    'meeting': 'scheduled|meeting|booked',
+}
+
+# Local cache and vector store locations
+CACHE_DIR = os.getenv("CRM_CACHE_DIR", ".crm_cache")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR")  # unset keeps the in-memory store
+CRM_TENANT = os.getenv("CRM_TENANT", "default")
+SHARED_DATASETS_MAX = int(os.getenv("SHARED_DATASETS_MAX", "8"))  # parsed workbooks kept for all sessions
+RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24"))
+
+# Bump when the metadata stored with each lead changes so existing stores get refreshed
+LEAD_METADATA_VERSION = 3
+
+# Duplicate detection compares each lead with its nearest neighbours inside its company/email-domain block
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.95"))
+DEDUP_NEIGHBOURS = int(os.getenv("DEDUP_NEIGHBOURS", "5"))
+# Lead search: metadata field filtered on for each lead log column, and the fields matched by keyword
+SEARCH_FILTERS = {'sales_rep': 'Sales Rep', 'status_stage': 'Status Stage', 'source': 'Source', 'priority': 'Priority'}
+KEYWORD_COLUMNS = ['Name', 'Company', 'Title', 'Notes', 'Next Step', 'Action Taken']
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "25"))
+RRF_K = 60  # rank offset for reciprocal rank fusion of vector and keyword results
+FREE_MAIL_DOMAINS = {'gmail.com', 'yahoo.com', 'outlook.com', 'hotmail.com', 'live.com', 'icloud.com',
+                     'rediffmail.com', 'protonmail.com'}
+
+# Retrieval settings for the sales coach; the prompt token budget decides how many are used
+COACH_TOP_K = int(os.getenv("COACH_TOP_K", "20"))
+QUERY_EMBEDDING_MEMORY_SIZE = 256
+
+# Lead fields sent to Gemini and the input token budget of each call site
+PROMPT_COLUMNS = ['Name', 'Company', 'Title', 'Source', 'Status Stage', 'Priority', 'Action Taken', 'Action Date',
+                  'Last Contact Date', 'Next Step', 'Due Date', 'Deal Value', 'Notes', 'Sales Rep']
+PROMPT_TOKEN_BUDGETS = {
+    'priorities': int(os.getenv("PRIORITIES_PROMPT_TOKENS", "2500")),
+    'coach': int(os.getenv("COACH_PROMPT_TOKENS", "1500")),
+}
+CHARS_PER_TOKEN = 4
+
 # Enhanced CSS for better UX
-st.markdown("""
+APP_CSS = """
 <style>
     /* Main container styling */
     .main-container {
@@ -111,98 +245,1908 @@ st.markdown("""
         color: white;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
-class SalesCRM:
+def activity_column(activity):
+    return f"Is {activity.title()}"
+
+def classify_activities(actions, rules=ACTIVITY_RULES):
+    """Activity flags for an 'Action Taken' series, matching each distinct value only once"""
+    actions = actions.astype('category')
+    labels = actions.cat.categories.astype(str).to_series()
+    codes = actions.cat.codes.to_numpy()
+    flags = {}
+    for activity, pattern in rules.items():
+        matched = labels.str.contains(pattern, case=False, regex=True).to_numpy()
+        # Code -1 marks a missing action, which lands on the trailing False
+        flags[activity_column(activity)] = np.append(matched, False)[codes]
+    return pd.DataFrame(flags, index=actions.index)
+
+def type_leads(df):
+    """Copy of the lead log with categorical labels, parsed dates and numeric deal values"""
+    df = df.copy()
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    for column in DATE_COLUMNS:
+        if column in df:
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+    if 'Deal Value' in df:
+        df['Deal Value'] = pd.to_numeric(df['Deal Value'], errors='coerce')
+    return df
+
+def normalize_leads(df, activity_rules=ACTIVITY_RULES):
+    """Typed copy of the lead log with activity flags; columns that are already typed are kept as they are"""
+    df = type_leads(df)
+    if 'Action Taken' in df:
+        flags = classify_activities(df['Action Taken'], activity_rules)
+        df[list(flags.columns)] = flags
+    return df
+
+def score_leads(df, as_of=None):
+    """Urgency score, days overdue and days since last contact for every lead, computed column-wise"""
+    as_of = pd.Timestamp(as_of or datetime.now()).normalize()
+    
+    def days_since(column):
+        dates = df[column] if pd.api.types.is_datetime64_any_dtype(df[column]) else pd.to_datetime(df[column], errors='coerce')
+        return (as_of - dates).dt.days.clip(lower=0).fillna(0).astype(int)
+    
+    overdue = days_since('Due Date')
+    stale = days_since('Last Contact Date')
+    deal_value = pd.to_numeric(df['Deal Value'], errors='coerce').fillna(0).clip(lower=0)
+    top_value = deal_value.max()
+    signals = {
+        'overdue': overdue.clip(upper=SCORE_HORIZON_DAYS) / SCORE_HORIZON_DAYS,
+        'staleness': stale.clip(upper=SCORE_HORIZON_DAYS) / SCORE_HORIZON_DAYS,
+        'deal_value': np.log1p(deal_value) / np.log1p(top_value) if top_value > 0 else deal_value * 0,
+        'priority': df['Priority'].map(PRIORITY_LEVELS).astype(float).fillna(0),
+        'stage': df['Status Stage'].map(STAGE_LEVELS).astype(float).fillna(0),
+    }
+    score = sum(LEAD_SCORE_WEIGHTS[name] * signal for name, signal in signals.items())
+    active = df['Status Stage'].isin(ACTIVE_STAGES)
+    return pd.DataFrame({
+        'Lead Score': score.where(active, 0).round(2),
+        'Days Overdue': overdue.where(active, 0),
+        'Days Since Contact': stale,
+    }, index=df.index)
+
+class LeadIndex:
+    """Row positions of each rep in a normalized lead log, built once per upload"""
+    
+    def __init__(self, df):
+        self.df = df
+        self.by_rep = df.groupby('Sales Rep', observed=True, sort=False).indices
+        self._keys = None
+        self._ids = None
+        self._positions = None
+        self._lock = threading.RLock()
+        self._ranking = None
+        self._keyword_text = None
+        self._activity_cube = None
+    
+    def rows_for(self, sales_rep):
+        return self.df.iloc[self.by_rep.get(sales_rep, [])]
+    
+    def ranked(self, sales_rep=None, as_of=None, mask=None, limit=None):
+        """Leads with their scores, highest score first; rescored once per day.
+        
+        Only the scores and the rank order are kept, so the rows are taken from the shared frame
+        on each call; mask (a boolean per row) and limit narrow them down before they are copied.
+        """
+        day = pd.Timestamp(as_of or datetime.now()).normalize()
+        if self._ranking is None or self._ranking[0] != day:
+            scores = score_leads(self.df, day)
+            order = np.argsort(-scores['Lead Score'].to_numpy(), kind='stable')
+            reps = self.df['Sales Rep'].iloc[order]
+            by_rep = reps.groupby(reps, observed=True, sort=False).indices
+            self._ranking = (day, scores, order, by_rep)
+        _, scores, order, by_rep = self._ranking
+        positions = order if sales_rep is None else order[by_rep.get(sales_rep, [])]
+        if mask is not None:
+            positions = positions[mask[positions]]
+        positions = positions[:limit]
+        return pd.concat([self.df.iloc[positions], scores.iloc[positions]], axis=1)
+    
+    def keyword_text(self):
+        """Lower-cased searchable text per row, computed on first use"""
+        if self._keyword_text is None:
+            columns = [column for column in KEYWORD_COLUMNS if column in self.df]
+            fields = [self.df[column].astype(object).where(self.df[column].notna(), '').astype(str) for column in columns]
+            self._keyword_text = fields[0].str.cat(fields[1:], sep=' ').str.lower()
+        return self._keyword_text
+    
+    def activity_cube(self, flags):
+        """Daily activity counts per rep, built on first use from the activity flags flags() returns"""
+        if self._activity_cube is None:
+            self._activity_cube = ActivityCube(self.df, flags())
+        return self._activity_cube
+    
+    def keys(self):
+        """Unique natural key of each row, computed once even when sessions ask concurrently"""
+        with self._lock:
+            if self._keys is None:
+                self._keys = lead_keys(self.df)
+            return self._keys
+    
+    def ids(self):
+        """Stable lead id of each row, computed once like keys"""
+        with self._lock:
+            if self._ids is None:
+                self._ids = lead_ids(self.df, self.keys())
+            return self._ids
+    
+    def positions(self):
+        """Row position of each stable lead id, computed on first use"""
+        if self._positions is None:
+            self._positions = {lead_id: position for position, lead_id in enumerate(self.ids())}
+        return self._positions
+
+def lead_measures(df, flags, index=None):
+    """Each lead's contribution to the rollup counters, one row per lead"""
+    stage = df['Status Stage']
+    won = stage == 'Closed Won'
+    deal_value = df['Deal Value'].fillna(0)
+    frame = pd.DataFrame({
+        'Sales Rep': df['Sales Rep'],
+        'Source': df['Source'],
+        'Status Stage': stage,
+        'Total Leads': 1,
+        'Active Leads': stage.isin(ACTIVE_STAGES),
+        'Closed Won': won,
+        'Calls Made': flags['Is Call'],
+        'Proposals Sent': flags['Is Proposal'],
+        'Meetings Booked': flags['Is Meeting'],
+        'Pipeline Value': deal_value,
+        'Won Value': deal_value.where(won, 0),
+    })
+    if index is not None:
+        frame.index = pd.Index(index)
+    return frame
+
+def rep_performance(totals):
+    """Rep dashboard metrics from their rollup counters"""
+    total_leads = int(totals['Total Leads'])
+    return {
+        'total_leads': total_leads,
+        'active_leads': int(totals['Active Leads']),
+        'conversion_rate': round(int(totals['Closed Won']) / total_leads * 100, 1) if total_leads > 0 else 0,
+        'calls_made': int(totals['Calls Made']),
+        'proposals_sent': int(totals['Proposals Sent']),
+        'meetings_booked': int(totals['Meetings Booked'])
+    }
+
+def team_tables(totals):
+    """Leaderboard, source and stage tables from the rollup counters of each dimension"""
+    by_rep = totals['Sales Rep'][['Total Leads', 'Active Leads', 'Closed Won', 'Calls Made', 'Proposals Sent',
+                                  'Meetings Booked', 'Pipeline Value']].copy()
+    by_rep.insert(3, 'Conversion Rate %', (by_rep['Closed Won'] / by_rep['Total Leads'] * 100).round(1))
+    
+    by_source = totals['Source'].rename(columns={'Closed Won': 'Won Deals', 'Won Value': 'Won Revenue'})[
+        ['Total Leads', 'Won Deals', 'Won Revenue', 'Pipeline Value']].copy()
+    by_source['Conversion Rate %'] = (by_source['Won Deals'] / by_source['Total Leads'] * 100).round(1)
+    
+    by_stage = totals['Status Stage'].rename(columns={'Total Leads': 'Leads', 'Pipeline Value': 'Deal Value'})[
+        ['Leads', 'Deal Value']].copy()
+    
+    return {
+        'reps': by_rep.sort_values(['Closed Won', 'Conversion Rate %', 'Active Leads'], ascending=False),
+        'sources': by_source.sort_values('Total Leads', ascending=False),
+        'stages': by_stage,
+    }
+
+class LeadRollup:
+    """Rollup counters per rep, source and stage for one workbook, updated by the leads that changed.
+    
+    Each sync diffs the new per-lead measures against the previous upload by lead key, subtracts
+    the old contribution of removed and changed leads and adds the new one of added and changed
+    leads; reads are dictionary lookups.
+    """
+    
     def __init__(self):
-        self.setup_gemini()
-        self.setup_vector_db()
-        self.data_loaded = False
-        
-    def setup_gemini(self):
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            st.error("GOOGLE_API_KEY not found in .env file")
-            st.stop()
-        self.client = genai.Client(api_key=api_key)
+        self.version = None
+        self.contributions = None
+        self.totals = {dimension: {} for dimension in ROLLUP_DIMENSIONS}
+        self._lock = threading.Lock()
     
-    def setup_vector_db(self):
-        self.chroma_client = chromadb.Client()
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="sales_leads",
-            metadata={"description": "Sales leads and activities"}
+    def sync(self, version, measures):
+        """Bring the counters to version, whose per-lead measures come from measures(); returns leads changed"""
+        with self._lock:
+            if version == self.version:
+                return 0
+            current = measures()
+            # Missing labels become '' so they compare equal across uploads
+            current[ROLLUP_DIMENSIONS] = current[ROLLUP_DIMENSIONS].astype(object).fillna('')
+            previous = self.contributions
+            if previous is None:
+                self._apply(current, 1)
+                changed = len(current)
+            else:
+                kept = current.index.intersection(previous.index)
+                differs = (current.loc[kept] != previous.loc[kept]).any(axis=1).to_numpy()
+                updated = kept[differs]
+                removed = previous.index.difference(current.index)
+                added = current.index.difference(previous.index)
+                self._apply(previous.loc[removed.append(updated)], -1)
+                self._apply(current.loc[added.append(updated)], 1)
+                changed = len(removed) + len(added) + len(updated)
+            self.version, self.contributions = version, current
+            return changed
+    
+    def _apply(self, rows, sign):
+        if rows.empty:
+            return
+        for dimension in ROLLUP_DIMENSIONS:
+            sums = rows.groupby(dimension, sort=False)[ROLLUP_MEASURES].sum()
+            counters = self.totals[dimension]
+            for key, values in zip(sums.index, sums.to_numpy(dtype=float)):
+                if key == '':
+                    continue
+                total = counters.get(key, 0) + sign * values
+                if total[0] > 0:
+                    counters[key] = total
+                else:
+                    counters.pop(key, None)
+    
+    def get(self, dimension, key):
+        """Counters for one rep, source or stage, or None when it has no leads"""
+        values = self.totals[dimension].get(key)
+        return None if values is None else dict(zip(ROLLUP_MEASURES, values))
+    
+    def table(self, dimension):
+        """Counters of every key in a dimension as a frame, keys in sorted order"""
+        with self._lock:
+            counters = dict(self.totals[dimension])
+        table = pd.DataFrame.from_dict(counters, orient='index', columns=ROLLUP_MEASURES).sort_index()
+        table.index.name = dimension
+        values = ['Pipeline Value', 'Won Value']
+        # Counts are exact in float64; values are rounded to cents after repeated deltas
+        table[values] = table[values].round(2)
+        return table.astype({measure: 'int64' for measure in ROLLUP_MEASURES if measure not in values})
+
+def report_measures(df, flags):
+    """Which manager report counts each row adds to"""
+    stage = df['Status Stage']
+    return pd.DataFrame({
+        'Activities': True,
+        'New Leads': flags['Is Connection'] | (stage == 'New'),
+        'Calls': flags['Is Call'],
+        'Proposals': flags['Is Proposal'] | (stage == 'Proposal Sent'),
+        'Deals Closed': (stage == 'Closed Won') | flags['Is Closed'],
+        'Contacted': stage.isin(['Contacted', 'Engaged', 'Proposal Sent', 'Negotiation']),
+        'Qualified': stage.isin(['Contacted', 'Engaged', 'Proposal Sent']),
+    }, index=df.index)
+
+class ActivityCube:
+    """Report counts per rep and 'Action Date' day, stored as running totals over days.
+    
+    The counts for any date range are the difference of two running totals, so a report
+    window costs the same whatever its length or the size of the log.
+    """
+    
+    def __init__(self, df, flags):
+        dates = df['Action Date']
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, errors='coerce')
+        days = dates.dt.normalize()
+        dated = (days.notna() & df['Sales Rep'].notna()).to_numpy()
+        codes, reps = pd.factorize(df['Sales Rep'][dated])
+        self.reps = {rep: code for code, rep in enumerate(reps)}
+        # Open pipeline is the rep's current state, so it ignores the date range
+        open_stages = df['Status Stage'].isin(['New', 'Contacted', 'Engaged', 'Proposal Sent', 'Negotiation'])
+        self.pipeline = open_stages.groupby(df['Sales Rep'], observed=True).sum().to_dict()
+        
+        if not dated.any():
+            self.start = None
+            self.totals = np.zeros((0, 1, len(REPORT_MEASURES)), dtype=np.int32)
+            return
+        self.start = days[dated].min()
+        offsets = (days[dated] - self.start).dt.days.to_numpy()
+        counts = np.zeros((len(reps), offsets.max() + 2, len(REPORT_MEASURES)), dtype=np.int32)
+        # Day d lands in slot d + 1, leaving slot 0 as the empty prefix
+        np.add.at(counts, (codes, offsets + 1), report_measures(df[dated], flags.loc[dated]).to_numpy(np.int32))
+        self.totals = np.cumsum(counts, axis=1, dtype=np.int32)
+    
+    def counts(self, sales_rep, start_date, end_date):
+        """Report counts for a rep's activities dated start_date through end_date"""
+        rep = self.reps.get(sales_rep)
+        if rep is None:
+            return dict.fromkeys(REPORT_MEASURES, 0)
+        days = self.totals.shape[1] - 1
+        first = min(max((pd.Timestamp(start_date).normalize() - self.start).days, 0), days)
+        last = min(max((pd.Timestamp(end_date).normalize() - self.start).days + 1, first), days)
+        return dict(zip(REPORT_MEASURES, (self.totals[rep, last] - self.totals[rep, first]).tolist()))
+
+def _format_date(value):
+    if pd.isna(value):
+        return ''
+    return value.strftime('%Y-%m-%d') if isinstance(value, datetime) else value
+
+def render_lead_document(row):
+    """Render a lead row as the text stored in the vector database"""
+    return f"""
+                    Lead: {row.get('Name', 'N/A')}
+                    Company: {row.get('Company', 'N/A')}
+                    Title: {row.get('Title', 'N/A')}
+                    Source: {row.get('Source', 'N/A')}
+                    Action Taken: {row.get('Action Taken', 'N/A')}
+                    Next Step: {row.get('Next Step', 'N/A')}
+                    Status: {row.get('Status Stage', 'N/A')}
+                    Sales Rep: {row.get('Sales Rep', 'N/A')}
+                    Notes: {row.get('Notes', '')}
+                    Due Date: {_format_date(row.get('Due Date', ''))}
+                    """
+
+class TrackerSnapshot:
+    """Parsed sheets of one tracker on disk, keyed by its content hash, one Arrow file per sheet.
+    
+    Files are written uncompressed and read memory-mapped, so re-opening a tracker skips the
+    Excel parse and processes serving the same file share its pages through the OS cache.
+    """
+    
+    def __init__(self, file_hash, root=None):
+        self.root = root or os.path.join(CACHE_DIR, "snapshots")
+        self.path = os.path.join(self.root, file_hash) if SNAPSHOTS_ENABLED and file_hash else None
+    
+    def _file(self, name):
+        return os.path.join(self.path, hashlib.sha256(name.encode('utf-8')).hexdigest()[:16] + ".arrow")
+    
+    def _write(self, path, write):
+        # Written under a private name and renamed, so readers never see a partial file
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    @property
+    def sheet_names(self):
+        """Sheet names of the tracker, or None when it has no snapshot yet"""
+        if self.path is None:
+            return None
+        try:
+            with open(os.path.join(self.path, "sheets.json"), encoding='utf-8') as f:
+                names = json.load(f)
+            os.utime(self.path)  # last use, for pruning
+        except (OSError, ValueError):
+            # Missing, or pruned by another process since
+            return None
+        return names
+    
+    def save_sheet_names(self, names):
+        if self.path is None:
+            return
+        def write(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(list(names), f)
+        self._write(os.path.join(self.path, "sheets.json"), write)
+        self.prune()
+    
+    def read(self, name):
+        """A snapshotted sheet, or None when it isn't snapshotted"""
+        if self.path is None or not os.path.exists(self._file(name)):
+            return None
+        return feather.read_table(self._file(name), memory_map=True).to_pandas()
+    
+    def write(self, name, df):
+        """Snapshot a parsed sheet; sheets Arrow can't represent (e.g. mixed-type columns) are skipped"""
+        if self.path is None:
+            return False
+        try:
+            self._write(self._file(name), lambda path: feather.write_feather(df, path, compression='uncompressed'))
+        except (ValueError, TypeError, OSError):
+            return False
+        return True
+    
+    def load(self, name, parse):
+        """Sheet from the snapshot, else parse() it and snapshot the result"""
+        sheet = self.read(name)
+        if sheet is None:
+            sheet = parse()
+            self.write(name, sheet)
+        return sheet
+    
+    def prune(self):
+        """Drop the least recently used snapshots beyond SNAPSHOT_CACHE_MAX_MB"""
+        snapshots = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                snapshots.append((entry.stat().st_mtime, size, entry.path))
+        total = sum(size for _, size, _ in snapshots)
+        for _, size, path in sorted(snapshots):
+            if total <= SNAPSHOT_CACHE_MAX_MB * 1024 * 1024:
+                break
+            if path != self.path:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+class LazyWorkbook(Mapping):
+    """Excel sheets parsed on first access instead of all at once, served from the tracker's snapshot when it has one"""
+    
+    def __init__(self, data, activity_rules=ACTIVITY_RULES, snapshot=None):
+        self.activity_rules = activity_rules
+        self.snapshot = snapshot or TrackerSnapshot(None)
+        self._data = data
+        self._lock = threading.Lock()
+        self._sheets = {}
+        self._excel = None
+        self._sheet_names = self.snapshot.sheet_names
+        if self._sheet_names is None:
+            self._sheet_names = self.excel.sheet_names
+            self.snapshot.save_sheet_names(self._sheet_names)
+    
+    @property
+    def excel(self):
+        # Only opened when a sheet has to be parsed from the workbook itself
+        if self._excel is None:
+            try:
+                self._excel = pd.ExcelFile(io.BytesIO(self._data), engine=EXCEL_ENGINE or None)
+            except (ImportError, ValueError):
+                self._excel = pd.ExcelFile(io.BytesIO(self._data))
+        return self._excel
+    
+    def _parse(self, name):
+        sheet = self.excel.parse(name)
+        return type_leads(sheet) if name == LEAD_LOG_SHEET else sheet
+    
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._sheets:
+                if name not in self._sheet_names:
+                    raise KeyError(name)
+                sheet = self.snapshot.load(name, lambda: self._parse(name))
+                if name == LEAD_LOG_SHEET:
+                    sheet = normalize_leads(sheet, self.activity_rules)
+                self._sheets[name] = sheet
+            return self._sheets[name]
+    
+    def __iter__(self):
+        return iter(self._sheet_names)
+    
+    def __len__(self):
+        return len(self._sheet_names)
+
+class TrackerFile(io.BytesIO):
+    """Tracker read from disk, shaped like a Streamlit upload"""
+    
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+
+def read_workbook(data, file_name, activity_rules=ACTIVITY_RULES, file_hash=None):
+    """Parse an uploaded tracker; only the lead log is read eagerly, from its snapshot when file_hash has one"""
+    snapshot = TrackerSnapshot(file_hash)
+    if file_name.endswith('.csv'):
+        lead_log = snapshot.load(LEAD_LOG_SHEET, lambda: type_leads(pd.read_csv(io.BytesIO(data))))
+        return {LEAD_LOG_SHEET: normalize_leads(lead_log, activity_rules)}
+    sheets = LazyWorkbook(data, activity_rules, snapshot)
+    sheets[LEAD_LOG_SHEET]  # fail fast if the lead log is missing
+    return sheets
+
+def document_hash(text):
+    """Content hash of a rendered lead document, used to detect changed leads"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def lead_metadata(row, doc_hash):
+    """Metadata stored alongside each lead in the vector database"""
+    metadata = {
+        'schema': LEAD_METADATA_VERSION,
+        'doc_hash': doc_hash,
+        'block': dedup_block(row),
+        'name': _clean(row.get('Name')),
+        'company': _clean(row.get('Company')),
+    }
+    deal_value = pd.to_numeric(row.get('Deal Value'), errors='coerce')
+    metadata['deal_value'] = 0.0 if pd.isna(deal_value) else float(deal_value)
+    for field, column in SEARCH_FILTERS.items():
+        metadata[field] = _clean(row.get(column))
+    # Dates are stored as YYYYMMDD integers so range filters work; missing dates are left out
+    due_date = pd.to_datetime(row.get('Due Date'), errors='coerce')
+    if not pd.isna(due_date):
+        metadata['due_date'] = int(due_date.strftime('%Y%m%d'))
+    return metadata
+
+def _clean(value):
+    return '' if pd.isna(value) else str(value).strip()
+
+def _clean_column(df, column, positions):
+    """Column at the given row positions as stripped text with '' for missing values, like _clean"""
+    if column not in df:
+        return pd.Series('', index=positions, dtype=object)
+    values = df[column].iloc[positions].astype(object)
+    return values.where(values.notna(), '').astype(str).str.strip()
+
+def _linkedin_key(df, positions):
+    # Text after the last '://', without a leading 'www.' or trailing slashes
+    return (_clean_column(df, 'LinkedIn URL', positions).str.lower().str.replace(r'^.*://', '', regex=True)
+            .str.removeprefix('www.').str.rstrip('/'))
+
+def lead_identities(df):
+    """Natural key for each lead: Email, then LinkedIn URL, then Phone, then Name and Company.
+    
+    Each fallback is only normalized for the rows the keys before it left empty.
+    """
+    keys = np.empty(len(df), dtype=object)
+    positions = np.arange(len(df))
+    for prefix, key in [
+        ('email:', lambda rows: _clean_column(df, 'Email', rows).str.lower()),
+        ('linkedin:', lambda rows: _linkedin_key(df, rows)),
+        ('phone:', lambda rows: _clean_column(df, 'Phone', rows).str.replace(r'\D', '', regex=True)),
+    ]:
+        if not len(positions):
+            return keys
+        values = key(positions).to_numpy(dtype=object)
+        found = values != ''
+        keys[positions[found]] = prefix + values[found]
+        positions = positions[~found]
+    if len(positions):
+        name = _clean_column(df, 'Name', positions).str.lower() + '|' + _clean_column(df, 'Company', positions).str.lower()
+        keys[positions] = 'name:' + name.to_numpy(dtype=object)
+    return keys
+
+def dedup_block(row):
+    """Blocking key for duplicate detection: a business email domain, else the normalized company name"""
+    domain = _clean(row.get('Email')).lower().rpartition('@')[2]
+    if domain and domain not in FREE_MAIL_DOMAINS:
+        return f"domain:{domain}"
+    company = re.sub(r'\b(pvt|private|ltd|limited|inc|llc|corp|corporation|co)\b|[^a-z0-9]', '',
+                     _clean(row.get('Company')).lower())
+    return f"company:{company}" if company else ''
+
+def lead_keys(df, seen=None):
+    """Unique natural key for every row; repeated identities are numbered in file order.
+    
+    seen maps each identity to its count in earlier chunks of the same file and is updated,
+    so a file read in chunks gets the keys it gets when read whole.
+    """
+    keys = lead_identities(df)
+    codes, identities = pd.factorize(keys)
+    occurrence = pd.Series(codes).groupby(codes, sort=False).cumcount().to_numpy() + 1
+    if seen is not None:
+        earlier = np.array([seen.get(identity, 0) for identity in identities], dtype=int)
+        occurrence += earlier[codes]
+        for identity, count in zip(identities, earlier + np.bincount(codes, minlength=len(identities))):
+            seen[identity] = int(count)
+    for position in np.flatnonzero(occurrence > 1):
+        keys[position] = f"{keys[position]}#{occurrence[position]}"
+    return keys
+
+def lead_ids(df, keys=None):
+    """Stable lead ids for every row, as stored in the vector database; keys are the rows' lead_keys if known"""
+    return [hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] for key in (lead_keys(df) if keys is None else keys)]
+
+def _prompt_values(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime('%Y-%m-%d').fillna('')
+    if pd.api.types.is_numeric_dtype(values):
+        return values.map(lambda value: '' if pd.isna(value) else f"{value:.0f}" if float(value).is_integer() else str(value))
+    text = values.astype(object).where(values.notna(), '').astype(str)
+    return text.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+def build_prompt_context(df, max_tokens, columns=PROMPT_COLUMNS):
+    """Leads as a compact pipe-separated table, keeping as many rows as fit in max_tokens.
+    
+    Rows are taken in df order, and fields that hold one value for every row are stated
+    once above the table instead of being repeated.
+    """
+    if df.empty:
+        return ""
+    budget = max_tokens * CHARS_PER_TOKEN
+    # No row is shorter than a couple of characters per field, which bounds the rows worth formatting
+    columns = [column for column in columns if column in df]
+    if not columns:
+        return ""
+    candidates = df.head(budget // (2 * len(columns)) + 1)
+    fields = {column: _prompt_values(candidates[column]) for column in columns}
+    
+    shared = [column for column in columns if fields[column].nunique() == 1] if len(candidates) > 1 else []
+    varying = [column for column in columns if column not in shared]
+    if not varying:
+        shared, varying = [], columns
+    lines = [f"{column}: {fields[column].iloc[0]}" for column in shared if fields[column].iloc[0]]
+    lines.append(" | ".join(varying))
+    
+    rows = fields[varying[0]].str.cat([fields[column] for column in varying[1:]], sep=" | ")
+    used = sum(len(line) + 1 for line in lines)
+    fits = rows[(rows.str.len() + 1).cumsum() <= budget - used]
+    lines.extend(fits)
+    if len(fits) < len(df):
+        lines.append(f"(+{len(df) - len(fits)} more leads not shown)")
+    return "\n".join(lines)
+
+class DiskCache:
+    """SQLite-backed key/value store that evicts least recently used entries past max_bytes"""
+    
+    def __init__(self, path, max_bytes, ttl=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL, created REAL)"
         )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(cache)")]
+        if 'created' not in columns:
+            self._conn.execute("ALTER TABLE cache ADD COLUMN created REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._conn.commit()
     
-    def load_all_sheets(self, uploaded_file):
+    def get_many(self, keys):
+        found = {}
+        oldest = time.time() - self.ttl if self.ttl else 0
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({placeholders}) "
+                    "AND COALESCE(created, 0) >= ?",
+                    [*chunk, oldest]
+                ).fetchall()
+                found.update(rows)
+                self._conn.execute(
+                    f"UPDATE cache SET accessed = ? WHERE key IN ({placeholders})",
+                    [time.time(), *chunk]
+                )
+            self._conn.commit()
+        return found
+    
+    def set_many(self, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed, created) VALUES (?, ?, ?, ?, ?)",
+                [(key, value, len(value), now, now) for key, value in items.items()]
+            )
+            if self.ttl:
+                self._conn.execute("DELETE FROM cache WHERE COALESCE(created, 0) < ?", (now - self.ttl,))
+            self._evict()
+            self._conn.commit()
+    
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM cache ORDER BY accessed"):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", stale)
+
+class EmbeddingCache:
+    """Embeddings keyed by a hash of the embedding model and the document text"""
+    
+    def __init__(self, path, max_bytes, model=EMBEDDING_MODEL):
+        self.model = model
+        self.store = DiskCache(path, max_bytes)
+    
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model}\n{text}".encode('utf-8')).hexdigest()
+    
+    def get_many(self, texts):
+        keys = {self._key(text): text for text in texts}
+        found = self.store.get_many(list(keys))
+        return {keys[key]: array('f', value).tolist() for key, value in found.items()}
+    
+    def set_many(self, embeddings):
+        self.store.set_many({
+            self._key(text): array('f', values).tobytes()
+            for text, values in embeddings.items()
+        })
+
+class ResponseCache:
+    """Generated text keyed by model and a whitespace-normalized prompt hash"""
+    
+    def __init__(self, path, max_bytes, ttl):
+        self.store = DiskCache(path, max_bytes, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+    
+    def _key(self, model, prompt):
+        normalized = " ".join(prompt.split())
+        return hashlib.sha256(f"{model}\n{normalized}".encode('utf-8')).hexdigest()
+    
+    def get(self, model, prompt):
+        value = self.store.get_many([self._key(model, prompt)])
+        if value:
+            self.hits += 1
+            return next(iter(value.values())).decode('utf-8')
+        self.misses += 1
+        return None
+    
+    def set(self, model, prompt, text):
+        self.store.set_many({self._key(model, prompt): text.encode('utf-8')})
+
+class Telemetry:
+    """Timing spans for each pipeline stage, exportable as JSON lines or Prometheus text"""
+    
+    def __init__(self, max_spans=2000):
+        self.spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def span(self, stage, **attributes):
+        record = {'stage': stage, 'started_at': time.time(), **attributes}
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record['error'] = True
+            raise
+        finally:
+            record['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            with self._lock:
+                self.spans.append(record)
+    
+    def records(self):
+        with self._lock:
+            return list(self.spans)
+    
+    def summary(self):
+        """Per-stage span counts, latency and token totals"""
+        spans = pd.DataFrame(self.records())
+        if spans.empty:
+            return spans
+        for column in ['feature', 'prompt_tokens', 'response_tokens', 'cache_hit']:
+            if column not in spans:
+                spans[column] = None
+        spans['feature'] = spans['feature'].fillna('')
+        spans[['prompt_tokens', 'response_tokens']] = spans[['prompt_tokens', 'response_tokens']].fillna(0).astype(int)
+        return spans.groupby(['stage', 'feature']).agg(
+            calls=('duration_ms', 'size'),
+            avg_ms=('duration_ms', 'mean'),
+            p95_ms=('duration_ms', lambda values: values.quantile(0.95)),
+            prompt_tokens=('prompt_tokens', 'sum'),
+            response_tokens=('response_tokens', 'sum'),
+            cache_hits=('cache_hit', lambda values: int(values.fillna(False).astype(bool).sum())),
+        ).round(1).reset_index()
+    
+    def to_jsonl(self):
+        return "".join(json.dumps(record, default=str) + "\n" for record in self.records())
+    
+    def to_prometheus(self):
+        totals = {}
+        for record in self.records():
+            key = (record['stage'], record.get('feature') or '')
+            entry = totals.setdefault(key, {'count': 0, 'seconds': 0.0, 'errors': 0, 'cache_hits': 0,
+                                            'prompt_tokens': 0, 'response_tokens': 0})
+            entry['count'] += 1
+            entry['seconds'] += record['duration_ms'] / 1000
+            entry['errors'] += int(bool(record.get('error')))
+            entry['cache_hits'] += int(bool(record.get('cache_hit')))
+            entry['prompt_tokens'] += record.get('prompt_tokens') or 0
+            entry['response_tokens'] += record.get('response_tokens') or 0
+        
+        lines = [
+            "# HELP crm_stage_duration_seconds Time spent in each Sales CRM pipeline stage",
+            "# TYPE crm_stage_duration_seconds summary",
+        ]
+        for (stage, feature), entry in totals.items():
+            labels = f'stage="{stage}",feature="{feature}"'
+            lines.append(f"crm_stage_duration_seconds_sum{{{labels}}} {entry['seconds']:.6f}")
+            lines.append(f"crm_stage_duration_seconds_count{{{labels}}} {entry['count']}")
+        for metric, field, help_text in [
+            ("crm_stage_errors_total", 'errors', "Spans that raised an error"),
+            ("crm_cache_hits_total", 'cache_hits', "Spans answered from a cache"),
+            ("crm_prompt_tokens_total", 'prompt_tokens', "Gemini prompt tokens"),
+            ("crm_response_tokens_total", 'response_tokens', "Gemini response tokens"),
+        ]:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for (stage, feature), entry in totals.items():
+                lines.append(f'{metric}{{stage="{stage}",feature="{feature}"}} {entry[field]}')
+        return "\n".join(lines) + "\n"
+
+def token_usage(response):
+    """Prompt and response token counts reported by Gemini, zero when missing"""
+    usage = getattr(response, 'usage_metadata', None)
+    return (
+        getattr(usage, 'prompt_token_count', None) or 0,
+        getattr(usage, 'candidates_token_count', None) or 0,
+    )
+
+def request_error_kind(error):
+    """'throttled' for 429s, 'transient' for errors worth retrying, None for ones that will fail again"""
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    text = str(error).upper()
+    if code == 429 or '429' in text or 'RESOURCE_EXHAUSTED' in text:
+        return 'throttled'
+    if code in (408, 500, 502, 503, 504) or isinstance(error, (TimeoutError, ConnectionError)):
+        return 'transient'
+    # httpx transport errors and SDK errors without a status code
+    if 'Timeout' in type(error).__name__ or 'Connect' in type(error).__name__:
+        return 'transient'
+    if any(status in text for status in ('UNAVAILABLE', 'DEADLINE_EXCEEDED', 'INTERNAL')):
+        return 'transient'
+    return None
+
+class TokenBucket:
+    """Request-rate limiter refilling at rate tokens per second, bursting up to capacity"""
+    
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, deadline):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                raise TimeoutError("Gemini request deadline passed while waiting for rate limit")
+            time.sleep(wait)
+
+class AdaptiveConcurrency:
+    """Cap on in-flight requests: grows by one per window of successes, halves on a 429"""
+    
+    def __init__(self, maximum, initial=None):
+        self.maximum = maximum
+        self.limit = float(initial or max(1, maximum // 4))
+        self.in_flight = 0
+        self._changed = threading.Condition()
+    
+    def acquire(self, deadline):
+        with self._changed:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Gemini request deadline passed while waiting for a free slot")
+                self._changed.wait(remaining)
+            self.in_flight += 1
+    
+    def release(self, outcome):
+        with self._changed:
+            self.in_flight -= 1
+            if outcome == 'throttled':
+                self.limit = max(1.0, self.limit / 2)
+            elif outcome == 'ok':
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._changed.notify_all()
+
+class GeminiGateway:
+    """Drop-in for the Gemini client's models API: every call is rate limited per model, runs under an
+    adaptive concurrency cap, and is retried with jittered backoff until its deadline"""
+    
+    def __init__(self, client, rpm=None, max_concurrency=GEMINI_MAX_CONCURRENCY,
+                 max_retries=GEMINI_MAX_RETRIES, deadline=GEMINI_DEADLINE_SECONDS):
+        self.client = client
+        self.models = self
+        self.rpm = dict(GEMINI_RPM if rpm is None else rpm)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self._limits = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+    
+    def _limiter(self, model):
+        with self._lock:
+            if model not in self._limits:
+                self._limits[model] = (TokenBucket(self.rpm.get(model, GEMINI_DEFAULT_RPM) / 60),
+                                       AdaptiveConcurrency(self.max_concurrency))
+                self._counts[model] = {'requests': 0, 'retries': 0, 'throttled': 0}
+            return self._limits[model]
+    
+    def _count(self, model, key):
+        with self._lock:
+            self._counts[model][key] += 1
+    
+    def call(self, model, request, retries=None, deadline=None):
+        """Result of request(), retrying throttled and transient failures until retries or the deadline run out"""
+        retries = self.max_retries if retries is None else retries
+        deadline = time.monotonic() + (deadline or self.deadline)
+        bucket, concurrency = self._limiter(model)
+        for attempt in range(retries + 1):
+            bucket.acquire(deadline)
+            concurrency.acquire(deadline)
+            self._count(model, 'requests')
+            outcome = 'error'
+            try:
+                result = request()
+                outcome = 'ok'
+                return result
+            except Exception as error:
+                kind = request_error_kind(error)
+                if kind == 'throttled':
+                    outcome = 'throttled'
+                    self._count(model, 'throttled')
+                # Full jitter keeps sessions that failed together from retrying together
+                delay = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+                if kind is None or attempt == retries or time.monotonic() + delay > deadline:
+                    raise
+            finally:
+                concurrency.release(outcome)
+            self._count(model, 'retries')
+            time.sleep(delay)
+    
+    def embed_content(self, *, model, contents, retries=None, **kwargs):
+        return self.call(model, lambda: self.client.models.embed_content(model=model, contents=contents, **kwargs),
+                         retries)
+    
+    def generate_content(self, *, model, contents, retries=None, **kwargs):
+        return self.call(model, lambda: self.client.models.generate_content(model=model, contents=contents, **kwargs),
+                         retries)
+    
+    def generate_content_stream(self, *, model, contents, retries=None, **kwargs):
+        # Retried until the first chunk arrives; after that the caller has shown partial text
+        def first_chunk():
+            stream = iter(self.client.models.generate_content_stream(model=model, contents=contents, **kwargs))
+            return next(stream, None), stream
+        
+        first, stream = self.call(model, first_chunk, retries)
+        if first is not None:
+            yield first
+            yield from stream
+    
+    def stats(self):
+        """Per-model quota, current concurrency limit and request counters"""
+        with self._lock:
+            return [
+                {'model': model, 'rpm': round(bucket.rate * 60), 'concurrency': int(concurrency.limit),
+                 'in_flight': concurrency.in_flight, **self._counts[model]}
+                for model, (bucket, concurrency) in self._limits.items()
+            ]
+
+class IngestJob:
+    """Background sync of one workbook into its vector store partition, with progress and cancellation"""
+    
+    def __init__(self, file_hash):
+        self.file_hash = file_hash
+        self.state = 'queued'
+        self.done = 0
+        self.total = 0
+        self.summary = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+    
+    @property
+    def running(self):
+        return self.state in ('queued', 'running')
+    
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+    
+    def cancel(self):
+        self._cancel.set()
+    
+    def percent(self):
+        if not self.total:
+            return 0 if self.running else 100
+        return int(100 * self.done / self.total)
+    
+    def report(self, done, total):
+        self.done, self.total = done, total
+    
+    def run(self, work):
+        self.state = 'running'
         try:
-            if uploaded_file.name.endswith('.csv'):
-                sheets = {'Daily Lead Log': pd.read_csv(uploaded_file)}
+            self.summary = work(self)
+            if self.cancelled:
+                self.state = 'cancelled'
             else:
-                sheets = pd.read_excel(uploaded_file, sheet_name=None)
-            
-            if not self.data_loaded:
-                daily_log = sheets['Daily Lead Log']
-                self.store_leads_in_db(daily_log)
-                self.data_loaded = True
-            
+                # Leads of failed batches are still missing; the job can be resumed like a cancelled one
+                self.state = 'partial' if self.summary and self.summary['failed'] else 'done'
+        except Exception as e:
+            self.error = str(e)
+            self.state = 'failed'
+        finally:
+            self.finished = time.time()
+
+class IngestCheckpoint:
+    """Number of leading rows of a streamed file already written to the vector database"""
+    
+    def __init__(self, path):
+        stat = os.stat(path)
+        identity = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        key = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:24]
+        self.path = os.path.join(CACHE_DIR, "ingest", f"{key}.json")
+    
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)['rows']
+        except (OSError, ValueError, KeyError):
+            return 0
+    
+    def save(self, rows):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'rows': rows}, f)
+        os.replace(tmp_path, self.path)
+    
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def create_gemini_client():
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise RuntimeError("GOOGLE_API_KEY not found in .env file")
+    # Bounds each HTTP request; GeminiGateway bounds the whole call including retries
+    return genai.Client(api_key=api_key, http_options={'timeout': int(GEMINI_TIMEOUT_SECONDS * 1000)})
+
+def partition_name(tenant, workbook=None, content_hash=None):
+    """Collection holding one tenant's workbook, or one version of it when content_hash is given;
+    leads outside any workbook use the original collection"""
+    if workbook is None:
+        return "sales_leads"
+    key = f"{tenant}/{workbook}" + (f"@{content_hash}" if content_hash else "")
+    return "sales_leads_" + hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+def collection_metadata(tenant, workbook=None, content_hash=None):
+    """Metadata stored with a partition's collection"""
+    return {"description": "Sales leads and activities", "tenant": tenant,
+            "workbook": workbook or "", "content_hash": content_hash or ""}
+
+class LeadStore:
+    """One vector store partition and its ingest state, locked so sessions don't ingest it twice"""
+    
+    def __init__(self, open_collection, content_hash=None):
+        self._open_collection = open_collection
+        self.content_hash = content_hash
+        # Live sessions attached to this partition and the file hash each has open
+        self.users = weakref.WeakKeyDictionary()
+        self._collection = None
+        self._open_lock = threading.Lock()
+        self.snapshot = None
+        self.ingested_file_hash = None
+        self.job = None
+        self.lock = threading.RLock()
+        # Duplicate pairs last found in this partition, shared by its sessions until leads are removed
+        self.duplicates = None
+        self.duplicates_lock = threading.Lock()
+        # Dashboard counters for whichever upload of this workbook was opened last
+        self.rollup = LeadRollup()
+    
+    @property
+    def collection(self):
+        # Opened on first use so pages that never search or ingest don't start Chroma
+        with self._open_lock:
+            if self._collection is None:
+                self._collection = self._open_collection()
+            return self._collection
+
+class SharedResources:
+    """Gemini client, caches, vector store partitions and parsed workbooks shared by every session"""
+    
+    def __init__(self, client=None):
+        # An injected client (tests, benchmarks, offline runs) needs no API key; a real one is
+        # only checked for here and created when a feature first calls Gemini
+        if client is None and not os.getenv("GOOGLE_API_KEY"):
+            raise RuntimeError("GOOGLE_API_KEY not found in .env file")
+        self._client = GeminiGateway(client) if client is not None else None
+        self._chroma_client = None
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(CACHE_DIR, "embeddings.sqlite3"),
+            EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        )
+        self.response_cache = ResponseCache(
+            os.path.join(CACHE_DIR, "responses.sqlite3"),
+            RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+            RESPONSE_CACHE_TTL_HOURS * 3600
+        )
+        self._stores = {}
+        self._datasets = OrderedDict()
+        self._building = {}
+        self._jobs = None
+        # Reentrant so a partition can be opened, renamed or dropped while attaching a session
+        self._lock = threading.RLock()
+    
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = GeminiGateway(create_gemini_client())
+            return self._client
+    
+    def gateway_stats(self):
+        """Gemini request counters, empty until the client is first used"""
+        return self._client.stats() if self._client is not None else []
+    
+    @property
+    def chroma_client(self):
+        with self._lock:
+            if self._chroma_client is None:
+                if CHROMA_PERSIST_DIR:
+                    self._chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+                else:
+                    self._chroma_client = chromadb.Client()
+            return self._chroma_client
+    
+    def store(self, workbook=None, tenant=CRM_TENANT, reattach=False, content_hash=None):
+        """Vector store partition for a tenant's workbook, or for one version of it when content_hash
+        is given; reattach re-fetches a dropped collection"""
+        name = partition_name(tenant, workbook, content_hash)
+        metadata = collection_metadata(tenant, workbook, content_hash)
+        
+        def open_collection():
+            return self.chroma_client.get_or_create_collection(name=name, metadata=metadata)
+        
+        with self._lock:
+            if reattach or name not in self._stores:
+                self._stores[name] = LeadStore(open_collection, content_hash)
+            return self._stores[name]
+    
+    def attach(self, session, workbook, file_hash, tenant=CRM_TENANT):
+        """Partition a session should use for file_hash of workbook.
+        
+        Re-uploads sync into the workbook's own partition by delta. When another live session
+        has different content of the same workbook open there, this session gets a partition
+        for its own content instead, so neither replaces the other's leads. Content partitions
+        are dropped once no session has them open.
+        """
+        with self._lock:
+            previous = getattr(session, 'store', None)
+            store = self.store(workbook, tenant)
+            if any(user is not session and other_hash != file_hash for user, other_hash in store.users.items()):
+                name = partition_name(tenant, workbook, file_hash)
+                if (name not in self._stores and previous is not None and previous.content_hash
+                        and self._stores.get(partition_name(tenant, workbook, previous.content_hash)) is previous
+                        and all(user is session for user in previous.users)):
+                    # Only this session has its last version open; move that partition to the
+                    # new content so the re-upload syncs by delta instead of embedding everything
+                    previous.collection.modify(name=name, metadata=collection_metadata(tenant, workbook, file_hash))
+                    del self._stores[partition_name(tenant, workbook, previous.content_hash)]
+                    previous.content_hash = file_hash
+                    self._stores[name] = previous
+                store = self.store(workbook, tenant, content_hash=file_hash)
+            if previous is not None and previous is not store:
+                previous.users.pop(session, None)
+            store.users[session] = file_hash
+            self._drop_unused_partitions()
+        return store
+    
+    def _drop_unused_partitions(self):
+        # Content partitions without live sessions, unless a job is still writing to them
+        for name, store in list(self._stores.items()):
+            if store.content_hash and not store.users and not (store.job and store.job.running):
+                del self._stores[name]
+                try:
+                    self.chroma_client.delete_collection(name)
+                except chromadb.errors.NotFoundError:
+                    pass
+    
+    def submit_ingest(self, store, file_hash, work, restart=False, new_upload=False):
+        """Background job syncing file_hash into store; the existing job for the same file is reused unless restart,
+        or unless it left leads unembedded and the file was uploaded again"""
+        with self._lock:
+            job = store.job
+            retry = restart or (new_upload and job is not None and job.state == 'partial')
+            if job is not None and job.file_hash == file_hash and not (retry and not job.running):
+                return job
+            if job is None and store.ingested_file_hash == file_hash:
+                return None
+            if job is not None and job.running:
+                # A newer upload supersedes the one still being indexed
+                job.cancel()
+            if self._jobs is None:
+                self._jobs = ThreadPoolExecutor(max_workers=INGEST_JOB_WORKERS, thread_name_prefix="ingest")
+            job = store.job = IngestJob(file_hash)
+            self._jobs.submit(job.run, work)
+            return job
+    
+    def dataset(self, key, build):
+        """Value for key from the shared dataset cache, built once even when sessions ask concurrently"""
+        with self._lock:
+            if key in self._datasets:
+                self._datasets.move_to_end(key)
+                return self._datasets[key]
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                if key in self._datasets:
+                    return self._datasets[key]
+            value = build()
+            with self._lock:
+                self._datasets[key] = value
+                if len(self._datasets) > SHARED_DATASETS_MAX:
+                    self._datasets.popitem(last=False)
+                self._building.pop(key, None)
+        return value
+
+class SalesCRM:
+    def __init__(self, embed_batch_size=EMBED_BATCH_SIZE, embed_max_workers=EMBED_MAX_WORKERS,
+                 embed_max_retries=EMBED_MAX_RETRIES, activity_rules=ACTIVITY_RULES,
+                 max_concurrent_generations=None, client=None, resources=None):
+        self.embed_batch_size = embed_batch_size
+        self.embed_max_workers = embed_max_workers
+        self.embed_max_retries = embed_max_retries
+        self.activity_rules = activity_rules
+        self._generation_slots = (
+            threading.BoundedSemaphore(max_concurrent_generations) if max_concurrent_generations else None
+        )
+        # Sessions in the app share one set of resources; scripts get a private one
+        self.resources = resources or SharedResources(client)
+        self.embedding_cache = self.resources.embedding_cache
+        self.response_cache = self.resources.response_cache
+        self.workbook = None
+        self.store = self.resources.store()
+        self._workbook = None
+        self._workbook_key = None
+        self._dataset_key = None
+        self.lead_index = None
+        self._team_performance = None
+        self.telemetry = Telemetry()
+        self._query_embeddings = OrderedDict()
+        
+    def setup_vector_db(self):
+        """(Re)attach to the vector store partition of the current workbook"""
+        self.store = self.resources.store(self.workbook, reattach=True, content_hash=self.store.content_hash)
+        if self._workbook is not None:
+            self.store.users[self] = self._workbook[0]
+    
+    @property
+    def client(self):
+        return self.resources.client
+    
+    @property
+    def chroma_client(self):
+        return self.resources.chroma_client
+    
+    @property
+    def collection(self):
+        return self.store.collection
+    
+    @property
+    def lead_snapshot(self):
+        return self.store.snapshot
+    
+    @lead_snapshot.setter
+    def lead_snapshot(self, snapshot):
+        self.store.snapshot = snapshot
+    
+    @property
+    def ingested_file_hash(self):
+        return self.store.ingested_file_hash
+    
+    @ingested_file_hash.setter
+    def ingested_file_hash(self, file_hash):
+        self.store.ingested_file_hash = file_hash
+    
+    def parse_tracker(self, uploaded_file):
+        """Parsed sheets for an uploaded or opened tracker, memoized by content hash"""
+        # Streamlit reruns hand back the same upload; skip hashing when the file id matches
+        file_id = getattr(uploaded_file, 'file_id', None)
+        if file_id is None or file_id != self._workbook_key:
+            data = uploaded_file.getvalue()
+            file_hash = hashlib.sha256(data).hexdigest()
+            if self._workbook is None or file_hash != self._workbook[0]:
+                def parse():
+                    with self.telemetry.span('load', bytes=len(data)) as span:
+                        sheets = read_workbook(data, uploaded_file.name, self.activity_rules, file_hash)
+                        lead_index = LeadIndex(sheets[LEAD_LOG_SHEET])
+                        span['rows'] = len(lead_index.df)
+                    return sheets, lead_index
+                
+                # Another session may already have parsed the same file with the same rules
+                key = (file_hash, json.dumps(self.activity_rules, sort_keys=True))
+                sheets, self.lead_index = self.resources.dataset(key, parse)
+                self._workbook = (file_hash, sheets)
+                self._dataset_key = key
+            if uploaded_file.name != self.workbook or self.store.users.get(self) != file_hash:
+                self.workbook = uploaded_file.name
+                self.store = self.resources.attach(self, self.workbook, file_hash)
+            self._workbook_key = file_id
+        return self._workbook
+    
+    def ingest_tracker(self, uploaded_file, on_progress=None):
+        """Parse a tracker and sync its lead log into the vector database if the content changed"""
+        file_hash, sheets = self.parse_tracker(uploaded_file)
+        summary = None
+        # A session that waited on the lock finds the file already ingested by another
+        with self.store.lock:
+            if file_hash != self.ingested_file_hash:
+                summary = self.store_leads_in_db(sheets[LEAD_LOG_SHEET], on_progress=on_progress)
+                # Leads of failed batches are embedded by the next run
+                if summary['failed'] == 0:
+                    self.ingested_file_hash = file_hash
+        return sheets, summary
+    
+    def start_ingest(self, uploaded_file, restart=False):
+        """Parse a tracker now and sync its lead log into the vector database in the background.
+        
+        A cancelled or failed job for the same file stays as it is until restart is passed; one that left
+        leads unembedded is also retried when the file is uploaded again.
+        """
+        # Streamlit reruns hand back the same upload with the same file id
+        file_id = getattr(uploaded_file, 'file_id', None)
+        new_upload = file_id is None or file_id != self._workbook_key
+        file_hash, sheets = self.parse_tracker(uploaded_file)
+        workbook, store, lead_index = self.workbook, self.store, self.lead_index
+        
+        def work(job):
+            # Runs only for a newly submitted job, on its own SalesCRM bound to this partition,
+            # so switching workbooks can't redirect it
+            worker = SalesCRM(self.embed_batch_size, self.embed_max_workers, self.embed_max_retries,
+                              self.activity_rules, resources=self.resources)
+            worker.workbook, worker.store, worker.telemetry = workbook, store, self.telemetry
+            worker.lead_index = lead_index
+            with worker.store.lock:
+                if worker.ingested_file_hash == file_hash:
+                    return None
+                summary = worker.store_leads_in_db(sheets[LEAD_LOG_SHEET], job=job)
+                if not job.cancelled and not summary['failed']:
+                    worker.ingested_file_hash = file_hash
+                return summary
+        
+        return sheets, self.resources.submit_ingest(self.store, file_hash, work, restart=restart,
+                                                     new_upload=new_upload)
+    
+    @property
+    def index_job(self):
+        """Latest background ingest of the current workbook, if any"""
+        return self.store.job
+    
+    def index_ready(self):
+        return self.store.job is None or not self.store.job.running
+    
+    def load_all_sheets(self, uploaded_file):
+        try:
+            # Leads are embedded in the background; DataFrame-only features work right away
+            sheets, _ = self.start_ingest(uploaded_file)
             return sheets
             
         except Exception as e:
             st.error(f"Error loading file: {e}")
             return None
     
-    def get_embeddings(self, text):
-        try:
+    def rep_slice(self, df, sales_rep):
+        """Rows for one rep, served from the per-rep index when df is the loaded lead log"""
+        if self.lead_index is not None and df is self.lead_index.df:
+            return self.lead_index.rows_for(sales_rep)
+        return df[df['Sales Rep'] == sales_rep]
+    
+    def ranked_leads(self, df, sales_rep=None, as_of=None):
+        """Leads (optionally one rep's) with score columns, most urgent first"""
+        if self.lead_index is not None and df is self.lead_index.df:
+            return self.lead_index.ranked(sales_rep, as_of)
+        return LeadIndex(df).ranked(sales_rep, as_of)
+    
+    def overdue_leads(self, df, sales_rep=None, as_of=None):
+        """Open leads past their due date, most urgent first"""
+        ranked = self.ranked_leads(df, sales_rep, as_of)
+        return ranked[ranked['Days Overdue'] > 0]
+    
+    def activity_flags(self, df):
+        """Activity flag columns for df, classifying on the fly for frames not loaded through the app"""
+        columns = [activity_column(activity) for activity in self.activity_rules]
+        if all(column in df for column in columns):
+            return df[columns]
+        return classify_activities(df['Action Taken'], self.activity_rules)
+    
+    def embed_query(self, text):
+        # Repeated questions are served from memory, then from the disk cache
+        if text in self._query_embeddings:
+            self._query_embeddings.move_to_end(text)
+            return self._query_embeddings[text]
+        embedding = self.embedding_cache.get_many([text]).get(text)
+        if embedding is None:
+            embedding = self.get_embeddings_batch([text], feature='query')[0]
+            self.embedding_cache.set_many({text: embedding})
+        else:
+            with self.telemetry.span('embed', feature='query', texts=1, cache_hit=True):
+                pass
+        self._query_embeddings[text] = embedding
+        if len(self._query_embeddings) > QUERY_EMBEDDING_MEMORY_SIZE:
+            self._query_embeddings.popitem(last=False)
+        return embedding
+    
+    def retrieve_leads(self, query, sales_rep, top_k=COACH_TOP_K):
+        """Ids of the stored leads most similar to query for one rep, best match first"""
+        if self.collection.count() == 0:
+            return []
+        query_embedding = self.embed_query(query)
+        with self.telemetry.span('retrieve', top_k=top_k) as span:
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=top_k,
+                where={'sales_rep': sales_rep},
+                include=['distances']
+            )
+            span['results'] = len(results['ids'][0])
+        return results['ids'][0]
+    
+    def rows_by_id(self, df, ids):
+        """Rows of df for the given lead ids, in the order given; unknown ids are skipped"""
+        index = self.lead_index if self.lead_index is not None and df is self.lead_index.df else LeadIndex(df)
+        positions = index.positions()
+        return df.iloc[[positions[lead_id] for lead_id in ids if lead_id in positions]]
+    
+    def search_leads(self, df, query="", filters=None, due_from=None, due_to=None, top_k=SEARCH_TOP_K):
+        """Leads matching the filters, ranked by fusing semantic and keyword matches on query.
+        
+        filters maps SEARCH_FILTERS fields to allowed values. Without a query, matching
+        leads are ranked by lead score.
+        """
+        filters = {field: list(values) for field, values in (filters or {}).items() if len(values)}
+        index = self.lead_index if self.lead_index is not None and df is self.lead_index.df else LeadIndex(df)
+        
+        with self.telemetry.span('search', filters=len(filters)) as span:
+            # Same filters as a boolean mask for the keyword side and a where clause for the vector side
+            mask = pd.Series(True, index=df.index)
+            conditions = []
+            for field, values in filters.items():
+                mask &= df[SEARCH_FILTERS[field]].isin(values)
+                conditions.append({field: {'$in': [str(value) for value in values]}})
+            due_dates = df['Due Date']
+            if not pd.api.types.is_datetime64_any_dtype(due_dates):
+                due_dates = pd.to_datetime(due_dates, errors='coerce')
+            if due_from is not None:
+                mask &= due_dates >= pd.Timestamp(due_from)
+                conditions.append({'due_date': {'$gte': int(pd.Timestamp(due_from).strftime('%Y%m%d'))}})
+            if due_to is not None:
+                mask &= due_dates <= pd.Timestamp(due_to)
+                conditions.append({'due_date': {'$lte': int(pd.Timestamp(due_to).strftime('%Y%m%d'))}})
+            
+            terms = query.lower().split()
+            if not terms:
+                results = index.ranked(mask=mask.to_numpy(), limit=top_k)
+                span['results'] = len(results)
+                return results.assign(Relevance=results['Lead Score'])
+            
+            fused = {}
+            positions = index.positions()
+            if self.collection.count():
+                vector = self.collection.query(
+                    query_embeddings=[self.embed_query(query)],
+                    n_results=top_k * 2,
+                    where=conditions[0] if len(conditions) == 1 else {'$and': conditions} if conditions else None,
+                    include=['distances']
+                )
+                for rank, lead_id in enumerate(vector['ids'][0]):
+                    if lead_id in positions:
+                        fused[positions[lead_id]] = 1 / (RRF_K + rank)
+            
+            text = index.keyword_text()[mask]
+            hits = sum(text.str.contains(term, regex=False).astype(int) for term in terms)
+            hits = hits[hits > 0].sort_values(ascending=False, kind='stable').head(top_k * 2)
+            for rank, position in enumerate(df.index.get_indexer(hits.index)):
+                fused[position] = fused.get(position, 0) + 1 / (RRF_K + rank)
+            
+            best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+            span['results'] = len(best)
+            return df.iloc[best].assign(Relevance=[round(fused[position] * 1000, 2) for position in best])
+    
+    def find_duplicates(self, df, threshold=DEDUP_SIMILARITY, neighbours=DEDUP_NEIGHBOURS):
+        """Likely duplicate lead pairs in df, most similar first.
+        
+        Leads are only compared within their company/email-domain block, and only with
+        their nearest stored neighbours, so the cost grows with the number of leads rather
+        than the number of pairs.
+        """
+        store = self.store
+        # Computed once per upload and partition, not once per session
+        with store.duplicates_lock:
+            cached = store.duplicates
+            if cached is not None and cached[0] is df and cached[1:3] == (threshold, neighbours):
+                return cached[3]
+            duplicates = self._find_duplicates(df, threshold, neighbours)
+            store.duplicates = (df, threshold, neighbours, duplicates)
+        return duplicates
+    
+    def _lead_ids(self, df):
+        """Lead ids of df, shared with search and the rollups when df is the loaded lead log"""
+        if self.lead_index is not None and df is self.lead_index.df:
+            return self.lead_index.ids()
+        return lead_ids(df)
+    
+    def _find_duplicates(self, df, threshold, neighbours):
+        with self.telemetry.span('dedup', rows=len(df)) as span:
+            records = df.to_dict('records')
+            ids = self._lead_ids(df)
+            members = {}
+            for lead_id, row in zip(ids, records):
+                block = dedup_block(row)
+                if block:
+                    members.setdefault(block, []).append((lead_id, row))
+            members = {block: leads for block, leads in members.items() if len(leads) > 1}
+            
+            candidate_ids = [lead_id for leads in members.values() for lead_id, _ in leads]
+            vectors = {}
+            for i in range(0, len(candidate_ids), 5000):
+                stored = self.collection.get(ids=candidate_ids[i:i + 5000], include=['embeddings'])
+                vectors.update(zip(stored['ids'], stored['embeddings']))
+            
+            pairs = {}
+            for block, leads in members.items():
+                leads = {lead_id: row for lead_id, row in leads if lead_id in vectors}
+                if len(leads) < 2:
+                    continue
+                queries = np.asarray([vectors[lead_id] for lead_id in leads], dtype=float)
+                results = self.collection.query(
+                    query_embeddings=queries,
+                    n_results=min(neighbours + 1, len(leads)),
+                    where={'block': block},
+                    include=['embeddings']
+                )
+                for lead_id, query, found_ids, found in zip(leads, queries, results['ids'], results['embeddings']):
+                    found = np.asarray(found, dtype=float)
+                    similarity = found @ query / (np.linalg.norm(found, axis=1) * np.linalg.norm(query) + 1e-12)
+                    for other_id, score in zip(found_ids, similarity):
+                        if other_id != lead_id and other_id in leads and score >= threshold:
+                            pairs[tuple(sorted((lead_id, other_id)))] = float(score)
+            span['pairs'] = len(pairs)
+            
+            rows = dict(zip(ids, records))
+            duplicates = pd.DataFrame([
+                {
+                    'Lead A': rows[first].get('Name'), 'Company A': rows[first].get('Company'),
+                    'Rep A': rows[first].get('Sales Rep'),
+                    'Lead B': rows[second].get('Name'), 'Company B': rows[second].get('Company'),
+                    'Rep B': rows[second].get('Sales Rep'),
+                    'Similarity': round(score, 3),
+                    'Lead A ID': first, 'Lead B ID': second,
+                }
+                for (first, second), score in sorted(pairs.items(), key=lambda item: -item[1])
+            ], columns=['Lead A', 'Company A', 'Rep A', 'Lead B', 'Company B', 'Rep B', 'Similarity',
+                        'Lead A ID', 'Lead B ID'])
+        return duplicates
+    
+    def remove_leads(self, ids):
+        """Drop leads from the vector store, e.g. the losing side of a reviewed duplicate"""
+        ids = list(dict.fromkeys(ids))
+        with self.store.lock:
+            for i in range(0, len(ids), 1000):
+                self.collection.delete(ids=ids[i:i + 1000])
+            if self.lead_snapshot is not None:
+                # Keep the current hash so unchanged re-uploads don't add them back
+                for lead_id in ids:
+                    self.lead_snapshot.setdefault(lead_id, None)
+            self.store.duplicates = None
+        return len(ids)
+    
+    def get_embeddings_batch(self, texts, feature='documents'):
+        # One request embeds the whole batch; the gateway retries it with jittered backoff
+        with self.telemetry.span('embed', feature=feature, texts=len(texts)):
             result = self.client.models.embed_content(
-                model="gemini-embedding-001",
-                contents=text
+                model=EMBEDDING_MODEL,
+                contents=texts,
+                retries=self.embed_max_retries
             )
-            return result.embeddings[0].values
-        except Exception as e:
-            st.error(f"Embedding error: {e}")
-            return None
+            return [embedding.values for embedding in result.embeddings]
+    
+    def _load_snapshot(self):
+        # Seed from the collection so a persistent store diffs against what it already holds
+        snapshot = {}
+        offset = 0
+        while True:
+            page = self.collection.get(include=['metadatas'], limit=5000, offset=offset)
+            for lead_id, metadata in zip(page['ids'], page['metadatas']):
+                metadata = metadata or {}
+                # Leads stored with older metadata are treated as changed
+                if metadata.get('schema') == LEAD_METADATA_VERSION:
+                    snapshot[lead_id] = metadata.get('doc_hash')
+                else:
+                    snapshot[lead_id] = None
+            if len(page['ids']) < 5000:
+                return snapshot
+            offset += 5000
+    
+    def _upsert_leads(self, ids, documents, embeddings, metadatas):
+        self.collection.upsert(
+            ids=ids,
+            documents=documents,
+            embeddings=embeddings,
+            metadatas=[metadatas[lead_id] for lead_id in ids]
+        )
+        if self.lead_snapshot is not None:
+            for lead_id in ids:
+                self.lead_snapshot[lead_id] = metadatas[lead_id]['doc_hash']
+    
+    def store_leads_in_db(self, df, on_progress=None, job=None):
+        with self.store.lock, self.telemetry.span('ingest', feature='delta', rows=len(df)) as span:
+            summary = self._store_leads(df, on_progress, job)
+            span.update({key: value for key, value in summary.items() if key != 'errors'})
+        return summary
     
-    def store_leads_in_db(self, df):
-        documents = []
-        embeddings = []
-        ids = []
+    def _store_leads(self, df, on_progress, job=None):
+        if self.lead_snapshot is None:
+            self.lead_snapshot = self._load_snapshot()
         
-        with st.status("Storing leads in vector database...", expanded=True) as status:
-            for idx, row in df.iterrows():
+        documents = {}
+        metadatas = {}
+        ids = self._lead_ids(df)
+        for lead_id, row in zip(ids, df.to_dict('records')):
+            documents[lead_id] = render_lead_document(row)
+            metadatas[lead_id] = lead_metadata(row, document_hash(documents[lead_id]))
+        
+        # Row-level diff against the last ingested snapshot
+        changed_ids = [
+            lead_id for lead_id in documents
+            if self.lead_snapshot.get(lead_id) != metadatas[lead_id]['doc_hash']
+        ]
+        removed_ids = [lead_id for lead_id in self.lead_snapshot if lead_id not in documents]
+        
+        cached = self.embedding_cache.get_many([documents[lead_id] for lead_id in changed_ids])
+        reused_ids = [lead_id for lead_id in changed_ids if documents[lead_id] in cached]
+        pending_ids = [lead_id for lead_id in changed_ids if documents[lead_id] not in cached]
+        batches = [
+            pending_ids[i:i + self.embed_batch_size]
+            for i in range(0, len(pending_ids), self.embed_batch_size)
+        ]
+        summary = {
+            'embedded': 0,
+            'cached': len(reused_ids),
+            'removed': len(removed_ids),
+            'unchanged': len(documents) - len(changed_ids),
+            'failed': 0,
+            'errors': [],
+        }
+        started = time.perf_counter()
+        if job:
+            job.report(0, len(changed_ids))
+        
+        for i in range(0, len(removed_ids), 1000):
+            batch = removed_ids[i:i + 1000]
+            self.collection.delete(ids=batch)
+            for lead_id in batch:
+                del self.lead_snapshot[lead_id]
+        
+        # Leads whose text was embedded before skip the API entirely
+        for i in range(0, len(reused_ids), self.embed_batch_size):
+            batch = reused_ids[i:i + self.embed_batch_size]
+            self._upsert_leads(
+                batch,
+                [documents[lead_id] for lead_id in batch],
+                [cached[documents[lead_id]] for lead_id in batch],
+                metadatas
+            )
+            if job:
+                job.report(i + len(batch), len(changed_ids))
+        
+        # Embed batches in parallel, writing each one as soon as it finishes
+        with ThreadPoolExecutor(max_workers=self.embed_max_workers) as pool:
+            futures = {
+                pool.submit(self.get_embeddings_batch, [documents[lead_id] for lead_id in batch]): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                batch = futures[future]
                 try:
-                    doc_text = f"""
-                    Lead: {row.get('Name', 'N/A')}
-                    Company: {row.get('Company', 'N/A')}
-                    Title: {row.get('Title', 'N/A')}
-                    Source: {row.get('Source', 'N/A')}
-                    Action Taken: {row.get('Action Taken', 'N/A')}
-                    Next Step: {row.get('Next Step', 'N/A')}
-                    Status: {row.get('Status Stage', 'N/A')}
-                    Sales Rep: {row.get('Sales Rep', 'N/A')}
-                    Notes: {row.get('Notes', '')}
-                    Due Date: {row.get('Due Date', '')}
-                    """
-                    
-                    embedding = self.get_embeddings(doc_text)
-                    if embedding:
-                        documents.append(doc_text)
-                        embeddings.append(embedding)
-                        ids.append(str(uuid.uuid4()))
-                    
+                    embeddings = future.result()
                 except Exception as e:
+                    summary['failed'] += len(batch)
+                    summary['errors'].append(f"Embedding batch of {len(batch)} leads failed: {e}")
+                else:
+                    batch_documents = [documents[lead_id] for lead_id in batch]
+                    self.embedding_cache.set_many(dict(zip(batch_documents, embeddings)))
+                    self._upsert_leads(batch, batch_documents, embeddings, metadatas)
+                    summary['embedded'] += len(batch)
+                    if job:
+                        job.report(summary['cached'] + summary['embedded'] + summary['failed'], len(changed_ids))
+                    if on_progress:
+                        rate = summary['embedded'] / max(time.perf_counter() - started, 1e-6)
+                        on_progress(f"Embedded {summary['embedded']}/{len(pending_ids)} leads ({rate:.0f} rows/sec)")
+                
+                if job and job.cancelled and not summary.get('cancelled'):
+                    # Queued batches are dropped; ones already embedding still finish and are written above,
+                    # and everything written stays in the store and the snapshot, so a rerun picks up the rest
+                    for pending in futures:
+                        pending.cancel()
+                    summary['cancelled'] = True
+        
+        return summary
+    
+    def stream_ingest_csv(self, path, chunk_size=INGEST_CHUNK_SIZE, on_progress=None):
+        """Upsert a large CSV export chunk by chunk, resuming after the last checkpointed row.
+        
+        Memory stays bounded by the chunk size and the number of batches in flight, so
+        rows missing from the file are not deleted. Repeated leads are numbered across chunks
+        and get the ids ingest_tracker gives them, which only needs a count per lead.
+        """
+        if os.path.basename(path) != self.workbook:
+            self.workbook = os.path.basename(path)
+            self.store = self.resources.store(self.workbook)
+        with self.store.lock, self.telemetry.span('ingest', feature='stream') as span:
+            summary = self._stream_ingest_csv(path, chunk_size, on_progress)
+            span.update({key: value for key, value in summary.items() if key != 'errors'})
+        return summary
+    
+    def _stream_ingest_csv(self, path, chunk_size, on_progress):
+        checkpoint = IngestCheckpoint(path)
+        committed = checkpoint.load()
+        summary = {
+            'embedded': 0, 'cached': 0, 'removed': 0, 'unchanged': 0, 'failed': 0,
+            'errors': [], 'resumed_from': committed,
+        }
+        chunk_states = OrderedDict()
+        in_flight = deque()
+        max_in_flight = self.embed_max_workers * 2
+        rows_read = 0
+        seen = {}
+        started = time.perf_counter()
+        
+        def finish(future, chunk_no, batch, documents, metadatas):
+            try:
+                embeddings = future.result()
+            except Exception as e:
+                summary['failed'] += len(batch)
+                summary['errors'].append(f"Embedding batch of {len(batch)} leads failed: {e}")
+                chunk_states[chunk_no]['failed'] = True
+            else:
+                batch_documents = [documents[lead_id] for lead_id in batch]
+                self.embedding_cache.set_many(dict(zip(batch_documents, embeddings)))
+                self._upsert_leads(batch, batch_documents, embeddings, metadatas)
+                summary['embedded'] += len(batch)
+            chunk_states[chunk_no]['outstanding'] -= 1
+        
+        def advance_checkpoint():
+            # Only a prefix of fully written chunks counts; a failed chunk holds the checkpoint back
+            nonlocal committed
+            while chunk_states:
+                state = next(iter(chunk_states.values()))
+                if state['outstanding'] or state['failed']:
+                    break
+                chunk_states.popitem(last=False)
+                committed = state['end']
+                checkpoint.save(committed)
+        
+        with ThreadPoolExecutor(max_workers=self.embed_max_workers) as pool, \
+                pd.read_csv(path, chunksize=chunk_size) as reader:
+            for chunk_no, chunk in enumerate(reader):
+                chunk_start = rows_read
+                rows_read += len(chunk)
+                # Rows written before a resume still count towards the numbering of repeated leads
+                keys = lead_keys(chunk, seen)
+                if rows_read <= committed:
                     continue
+                skipped = max(committed - chunk_start, 0)
+                chunk = normalize_leads(chunk.iloc[skipped:], self.activity_rules)
+                
+                documents = {}
+                metadatas = {}
+                for lead_id, row in zip(lead_ids(chunk, keys[skipped:]), chunk.to_dict('records')):
+                    documents[lead_id] = render_lead_document(row)
+                    metadatas[lead_id] = lead_metadata(row, document_hash(documents[lead_id]))
+                
+                # Diff the chunk against what the store already holds
+                stored = self.collection.get(ids=list(documents), include=['metadatas'])
+                stored_hashes = {
+                    lead_id: metadata.get('doc_hash')
+                    for lead_id, metadata in zip(stored['ids'], stored['metadatas'])
+                    if metadata and metadata.get('schema') == LEAD_METADATA_VERSION
+                }
+                changed_ids = [
+                    lead_id for lead_id in documents
+                    if stored_hashes.get(lead_id) != metadatas[lead_id]['doc_hash']
+                ]
+                summary['unchanged'] += len(documents) - len(changed_ids)
+                
+                cached = self.embedding_cache.get_many([documents[lead_id] for lead_id in changed_ids])
+                reused_ids = [lead_id for lead_id in changed_ids if documents[lead_id] in cached]
+                if reused_ids:
+                    self._upsert_leads(
+                        reused_ids,
+                        [documents[lead_id] for lead_id in reused_ids],
+                        [cached[documents[lead_id]] for lead_id in reused_ids],
+                        metadatas
+                    )
+                    summary['cached'] += len(reused_ids)
+                
+                pending_ids = [lead_id for lead_id in changed_ids if documents[lead_id] not in cached]
+                batches = [
+                    pending_ids[i:i + self.embed_batch_size]
+                    for i in range(0, len(pending_ids), self.embed_batch_size)
+                ]
+                chunk_states[chunk_no] = {'end': rows_read, 'outstanding': len(batches), 'failed': False}
+                for batch in batches:
+                    future = pool.submit(self.get_embeddings_batch, [documents[lead_id] for lead_id in batch])
+                    in_flight.append((future, chunk_no, batch, documents, metadatas))
+                
+                # Backpressure: stop reading until the embedding pool catches up
+                while len(in_flight) > max_in_flight:
+                    finish(*in_flight.popleft())
+                advance_checkpoint()
+                
+                if on_progress:
+                    rate = (rows_read - summary['resumed_from']) / max(time.perf_counter() - started, 1e-6)
+                    on_progress(f"Read {rows_read} rows, {summary['embedded']} embedded ({rate:.0f} rows/sec)")
             
-            if documents:
-                self.collection.add(
-                    documents=documents,
-                    embeddings=embeddings,
-                    ids=ids
-                )
-                status.update(label=f"✅ Stored {len(documents)} leads in vector database", state="complete")
+            while in_flight:
+                finish(*in_flight.popleft())
+            advance_checkpoint()
+        
+        if not summary['failed']:
+            checkpoint.clear()
+        # The in-memory snapshot no longer reflects the store
+        self.lead_snapshot = None
+        self.ingested_file_hash = None
+        return summary
+    
+    def generate_text(self, prompt, force=False, model=GENERATION_MODEL, feature=None):
+        with self.telemetry.span('generate', feature=feature, model=model, cache_hit=False) as span:
+            # Identical prompts are answered from the response cache unless forced
+            if not force:
+                cached = self.response_cache.get(model, prompt)
+                if cached is not None:
+                    span['cache_hit'] = True
+                    return cached
+            
+            if self._generation_slots:
+                with self._generation_slots:
+                    response = self.client.models.generate_content(model=model, contents=prompt)
+            else:
+                response = self.client.models.generate_content(model=model, contents=prompt)
+            span['prompt_tokens'], span['response_tokens'] = token_usage(response)
+            if response.text:
+                self.response_cache.set(model, prompt, response.text)
+            return response.text
+    
+    def stream_text(self, prompt, force=False, model=GENERATION_MODEL, feature=None):
+        # Yields text chunks as they arrive; the full text is cached once the stream completes
+        with self.telemetry.span('generate', feature=feature, model=model, cache_hit=False, stream=True) as span:
+            if not force:
+                cached = self.response_cache.get(model, prompt)
+                if cached is not None:
+                    span['cache_hit'] = True
+                    yield cached
+                    return
+            
+            started = time.perf_counter()
+            chunks = []
+            for chunk in self.client.models.generate_content_stream(
+                model=model,
+                contents=prompt
+            ):
+                # Usage metadata is cumulative, so the last chunk carries the totals
+                span['prompt_tokens'], span['response_tokens'] = token_usage(chunk)
+                if chunk.text:
+                    if not chunks:
+                        span['first_token_ms'] = round((time.perf_counter() - started) * 1000, 3)
+                    chunks.append(chunk.text)
+                    yield chunk.text
+            # A blocked or empty response is not worth serving again
+            if chunks:
+                self.response_cache.set(model, prompt, "".join(chunks))
+    
+    def _respond(self, prompt, force, stream, feature, error_label):
+        if not stream:
+            return self.generate_text(prompt, force=force, feature=feature)
+        return self._guarded_stream(self.stream_text(prompt, force=force, feature=feature), error_label)
+    
+    def _guarded_stream(self, chunks, error_label):
+        # Streaming errors surface after the caller's try block, so report them inline
+        try:
+            yield from chunks
+        except Exception as e:
+            yield f"{error_label}: {str(e)}"
     
-    def analyze_with_ai(self, df, sales_rep=None):
+    def analyze_with_ai(self, df, sales_rep=None, force=False, stream=False):
         try:
             rep_filter = f" for {sales_rep}" if sales_rep else ""
+            # The model picks from the highest-scoring open leads rather than the whole log
+            ranked = self.ranked_leads(df, sales_rep)
+            leads = ranked[ranked['Lead Score'] > 0].head(PRIORITIES_TOP_N)
+            context = build_prompt_context(
+                leads, PROMPT_TOKEN_BUDGETS['priorities'],
+                columns=PROMPT_COLUMNS + ['Days Overdue', 'Days Since Contact']
+            )
             
             prompt = f"""
             Analyze this sales data{rep_filter} and provide SPECIFIC, ACTIONABLE advice in this EXACT structured format:
@@ -246,23 +2190,18 @@ class SalesCRM:
             **Timeline:** [When to act]
             **Confidence:** [High/Medium]
 
-            DATA TO ANALYZE:
-            {df.to_string() if len(df) < 15 else df.head(15).to_string()}
+            DATA TO ANALYZE (open leads ranked by urgency, most urgent first):
+            {context}
 
             Focus on SPECIFIC names, companies, and ACTIONS from the data provided.
             """
             
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=prompt
-            )
-            
-            return response.text
+            return self._respond(prompt, force, stream, "priorities", "Analysis error")
             
         except Exception as e:
             return f"Analysis error: {str(e)}"
     
-    def generate_followup_message(self, lead_data, message_type="default"):
+    def generate_followup_message(self, lead_data, message_type="default", force=False, stream=False):
         try:
             if message_type == "connection":
                 prompt = f"""
@@ -359,66 +2298,34 @@ class SalesCRM:
                 Notes: {lead_data.get('Notes', '')}
                 """
             
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=prompt
-            )
-            
-            return response.text
+            return self._respond(prompt, force, stream, "message", "Message generation error")
             
         except Exception as e:
             return f"Message generation error: {str(e)}"
     
-    def generate_manager_report(self, df, sales_rep, start_date, end_date):
+    def report_counts(self, df, sales_rep, start_date, end_date):
+        """Manager report counts for a rep's date range, plus their current open pipeline"""
+        if self.lead_index is not None and df is self.lead_index.df:
+            cube = self.lead_index.activity_cube(lambda: self.activity_flags(df))
+        else:
+            rep_data = self.rep_slice(df, sales_rep)
+            cube = ActivityCube(rep_data, self.activity_flags(rep_data))
+        return cube.counts(sales_rep, start_date, end_date), int(cube.pipeline.get(sales_rep, 0))
+    
+    def generate_manager_report(self, df, sales_rep, start_date, end_date, force=False, stream=False):
         try:
-            # Ensure Action Date is datetime and handle NaT
-            df['Action Date'] = pd.to_datetime(df['Action Date'], errors='coerce')
-            
-            # Filter data for the specific rep and date range
-            mask = (
-                (df['Sales Rep'] == sales_rep) & 
-                (df['Action Date'].notna()) &
-                (df['Action Date'] >= pd.to_datetime(start_date)) & 
-                (df['Action Date'] <= pd.to_datetime(end_date))
-            )
-            date_data = df[mask]
+            # Range counts come from the activity cube; only the narrative below calls Gemini
+            counts, active_pipeline = self.report_counts(df, sales_rep, start_date, end_date)
             
-            if date_data.empty:
+            if counts['Activities'] == 0:
                 return f"No activity found for {sales_rep} from {start_date} to {end_date}"
             
-            # Calculate metrics correctly
-            total_activities = len(date_data)
-            
-            # Count specific activities more accurately
-            new_leads = len(date_data[
-                (date_data['Action Taken'].str.contains('connection|connect|initial', case=False, na=False)) |
-                (date_data['Status Stage'] == 'New')
-            ])
-            
-            calls_made = len(date_data[
-                date_data['Action Taken'].str.contains('call|phone|discussion', case=False, na=False)
-            ])
-            
-            proposals_sent = len(date_data[
-                date_data['Action Taken'].str.contains('proposal|quote|estimate', case=False, na=False) |
-                (date_data['Status Stage'] == 'Proposal Sent')
-            ])
-            
-            deals_closed = len(date_data[
-                (date_data['Status Stage'] == 'Closed Won') |
-                (date_data['Action Taken'].str.contains('closed|won|signed', case=False, na=False))
-            ])
-            
-            # Active pipeline (current state, not just date-filtered)
-            current_active = df[
-                (df['Sales Rep'] == sales_rep) & 
-                (df['Status Stage'].isin(['New', 'Contacted', 'Engaged', 'Proposal Sent', 'Negotiation']))
-            ]
-            
-            # Better conversion rate calculations
-            contacted_leads = len(date_data[
-                date_data['Status Stage'].isin(['Contacted', 'Engaged', 'Proposal Sent', 'Negotiation'])
-            ])
+            total_activities = counts['Activities']
+            new_leads = counts['New Leads']
+            calls_made = counts['Calls']
+            proposals_sent = counts['Proposals']
+            deals_closed = counts['Deals Closed']
+            contacted_leads = counts['Contacted']
             
             # Safe conversion rate calculations with better logic
             if new_leads > 0:
@@ -432,7 +2339,7 @@ class SalesCRM:
                 contact_to_proposal = 0
             
             # Overall conversion based on actual closed deals vs qualified activities
-            qualified_activities = len(date_data[date_data['Status Stage'].isin(['Contacted', 'Engaged', 'Proposal Sent'])])
+            qualified_activities = counts['Qualified']
             if qualified_activities > 0:
                 overall_conversion = min((deals_closed / qualified_activities) * 100, 100.0)
             else:
@@ -451,7 +2358,7 @@ class SalesCRM:
             • Calls/Discussions: {calls_made}
             • Proposals Sent: {proposals_sent}
             • Deals Closed: {deals_closed}
-            • Current Active Pipeline: {len(current_active)}
+            • Current Active Pipeline: {active_pipeline}
 
             📈 CONVERSION INSIGHTS:
             • Lead-to-Contact: {lead_to_contact:.1%}
@@ -472,23 +2379,22 @@ class SalesCRM:
             Use only the metrics provided above.
             """
             
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=prompt
-            )
-            
-            return response.text
+            return self._respond(prompt, force, stream, "report", "Report generation error")
             
         except Exception as e:
             return f"Report generation error: {str(e)}"
     
-    def sales_coach_chat(self, query, df, sales_rep):
+    def sales_coach_chat(self, query, df, sales_rep, force=False, stream=False):
         try:
+            # Only the leads most relevant to the question go into the prompt
+            retrieved = self.retrieve_leads(query, sales_rep) if not df.empty else []
+            pipeline = build_prompt_context(self.rows_by_id(df, retrieved), PROMPT_TOKEN_BUDGETS['coach'])
+            
             prompt = f"""
             As an expert sales coach with 15+ years experience, provide SPECIFIC, ACTIONABLE advice to {sales_rep}.
 
-            CURRENT PIPELINE SNAPSHOT:
-            {df[df['Sales Rep'] == sales_rep][['Name', 'Company', 'Status Stage', 'Action Taken', 'Next Step']].head(8).to_string() if not df.empty else "No current data"}
+            MOST RELEVANT LEADS IN THE PIPELINE:
+            {pipeline or "No current data"}
 
             QUESTION: {query}
 
@@ -518,35 +2424,101 @@ class SalesCRM:
             Keep it practical and specific to their pipeline data.
             """
             
-            response = self.client.models.generate_content(
-                model="gemini-2.0-flash", 
-                contents=prompt
-            )
-            
-            return response.text
+            return self._respond(prompt, force, stream, "coach", "Coach error")
             
         except Exception as e:
             return f"Coach error: {str(e)}"
     
     def get_rep_performance(self, df, sales_rep):
-        rep_data = df[df['Sales Rep'] == sales_rep]
+        with self.telemetry.span('metrics', feature='rep'):
+            rollup = self._rollup(df)
+            if rollup is None:
+                return self._rep_performance(df, sales_rep)
+            totals = rollup.get('Sales Rep', sales_rep)
+            return rep_performance(totals) if totals else {}
+    
+    def _rep_performance(self, df, sales_rep):
+        rep_data = self.rep_slice(df, sales_rep)
         
         if rep_data.empty:
             return {}
-            
-        total_leads = len(rep_data)
-        active_leads = len(rep_data[rep_data['Status Stage'].isin(['New', 'Contacted', 'Engaged', 'Proposal Sent'])])
-        closed_won = len(rep_data[rep_data['Status Stage'] == 'Closed Won'])
-        conversion_rate = (closed_won / total_leads * 100) if total_leads > 0 else 0
-        
-        return {
-            'total_leads': total_leads,
-            'active_leads': active_leads,
-            'conversion_rate': round(conversion_rate, 1),
-            'calls_made': len(rep_data[rep_data['Action Taken'].str.contains('call', case=False, na=False)]),
-            'proposals_sent': len(rep_data[rep_data['Action Taken'] == 'Sent proposal']),
-            'meetings_booked': len(rep_data[rep_data['Action Taken'] == 'Call scheduled'])
-        }
+        
+        return rep_performance(lead_measures(rep_data, self.activity_flags(rep_data))[ROLLUP_MEASURES].sum())
+    
+    def _rollup(self, df):
+        """Rollup counters for the loaded lead log, synced to it by deltas; None for other frames"""
+        if self.lead_index is None or df is not self.lead_index.df:
+            return None
+        rollup = self.store.rollup
+        if rollup.version != self._dataset_key:
+            with self.telemetry.span('rollup', rows=len(df)) as span:
+                span['changed'] = rollup.sync(self._dataset_key, lambda: lead_measures(
+                    df, self.activity_flags(df), self.lead_index.keys()))
+        return rollup
+
+    def get_team_performance(self, df):
+        """Leaderboard plus source and stage breakdowns, from the rollup counters when df is the loaded log"""
+        if self._team_performance is not None and self._team_performance[0] is df:
+            return self._team_performance[1]
+        with self.telemetry.span('metrics', feature='team', rows=len(df)):
+            rollup = self._rollup(df)
+            if rollup is None:
+                team = self._team_breakdowns(df)
+            else:
+                team = team_tables({dimension: rollup.table(dimension) for dimension in ROLLUP_DIMENSIONS})
+        self._team_performance = (df, team)
+        return team
+    
+    def _team_breakdowns(self, df):
+        measures = lead_measures(df, self.activity_flags(df))
+        return team_tables({
+            dimension: measures.groupby(dimension, observed=True)[ROLLUP_MEASURES].sum()
+            for dimension in ROLLUP_DIMENSIONS
+        })
+
+def format_ingest_summary(summary):
+    text = (
+        f"Vector database updated: {summary['embedded']} embedded, {summary['cached']} from cache, "
+        f"{summary['removed']} removed, {summary['unchanged']} unchanged"
+    )
+    if summary['failed']:
+        text += f", {summary['failed']} failed to embed"
+    if summary.get('cancelled'):
+        text += " (cancelled before finishing)"
+    return text
+
+def render_indexing_status(crm, uploaded_file, was_running):
+    """Sidebar progress of the background ingest; reruns the app once it finishes"""
+    job = crm.index_job
+    if job is None:
+        return
+    if job.running:
+        st.progress(job.percent() / 100, text=f"Indexing leads, {job.percent()}% done")
+        if st.button("Cancel indexing", use_container_width=True):
+            job.cancel()
+        return
+    if was_running:
+        # Vector-backed features were showing a notice; redraw them now that the index is ready
+        st.rerun(scope="app")
+    if job.state == 'failed':
+        st.error(f"Indexing failed: {job.error}")
+    elif job.state == 'cancelled':
+        st.warning(f"Indexing cancelled at {job.percent()}%")
+    elif job.summary:
+        st.caption(f"{'⚠️' if job.summary['failed'] else '✅'} {format_ingest_summary(job.summary)}")
+        for error in job.summary['errors']:
+            st.warning(error)
+    if job.state in ('failed', 'cancelled', 'partial'):
+        if st.button("Resume indexing", use_container_width=True):
+            crm.start_ingest(uploaded_file, restart=True)
+            st.rerun(scope="app")
+
+def indexing_notice(crm, feature):
+    """Show indexing progress in place of a vector-backed feature; True when the feature can run"""
+    if crm.index_ready():
+        return True
+    st.info(f"🔄 Indexing leads, {crm.index_job.percent()}% done - {feature} will be available when it finishes")
+    return False
 
 def send_whatsapp_message(phone_number, message):
     """Generate WhatsApp URL with pre-filled message"""
@@ -555,20 +2527,63 @@ def send_whatsapp_message(phone_number, message):
     whatsapp_url = f"https://wa.me/{clean_phone}?text={encoded_message}"
     return whatsapp_url
 
+def render_response(response, css_class):
+    """Render a text or streamed response into a styled block and return the full text"""
+    placeholder = st.empty()
+    text = ""
+    if isinstance(response, str):
+        text = response
+    else:
+        placeholder.markdown(f'<div class="{css_class}">▌</div>', unsafe_allow_html=True)
+        for chunk in response:
+            text += chunk
+            placeholder.markdown(f'<div class="{css_class}">{text}▌</div>', unsafe_allow_html=True)
+    placeholder.markdown(f'<div class="{css_class}">{text}</div>', unsafe_allow_html=True)
+    return text
+
+@st.cache_resource(show_spinner=False)
+def shared_resources():
+    """One set of clients, caches and parsed workbooks for every browser session in this process"""
+    return SharedResources()
+
+def render_diagnostics(container, telemetry, gateway_stats=()):
+    """Sidebar panel with per-stage timings and exports for monitoring"""
+    with container:
+        st.markdown("#### Diagnostics")
+        if gateway_stats:
+            st.caption("Gemini requests")
+            st.dataframe(pd.DataFrame(gateway_stats), hide_index=True, use_container_width=True)
+        summary = telemetry.summary()
+        if summary.empty:
+            st.caption("No spans recorded yet")
+            return
+        st.dataframe(summary, hide_index=True, use_container_width=True)
+        with st.expander("Recent spans"):
+            st.dataframe(pd.DataFrame(telemetry.records()[-50:]), hide_index=True, use_container_width=True)
+        st.download_button("Export JSON lines", telemetry.to_jsonl(), file_name="crm_spans.jsonl",
+                           use_container_width=True)
+        st.download_button("Export Prometheus", telemetry.to_prometheus(), file_name="crm_metrics.prom",
+                           use_container_width=True)
+
 def main():
     st.set_page_config(
         page_title="Sales CRM AI Assistant", 
         layout="wide",
         page_icon="📊"
     )
+    st.markdown(APP_CSS, unsafe_allow_html=True)
     
     # Header
     st.title("Sales CRM AI Assistant")
     st.markdown("Transform your sales process with AI-powered insights and automation")
     
-    # Initialize CRM
+    # Initialize CRM; sessions only hold per-user state on top of the shared resources
     if 'crm' not in st.session_state:
-        st.session_state.crm = SalesCRM()
+        try:
+            st.session_state.crm = SalesCRM(resources=shared_resources())
+        except RuntimeError as e:
+            st.error(str(e))
+            st.stop()
     
     crm = st.session_state.crm
     
@@ -587,6 +2602,11 @@ def main():
         if uploaded_file:
             st.success("Data uploaded successfully")
             
+        indexing = st.container()
+        cache_stats = st.empty()
+        show_diagnostics = st.checkbox("Show diagnostics", help="Per-stage latency, tokens and cache hits")
+        diagnostics = st.container()
+        
         st.markdown("---")
         st.header("Features")
         st.markdown("""
@@ -600,7 +2620,14 @@ def main():
     if uploaded_file:
         sheets = crm.load_all_sheets(uploaded_file)
         if sheets:
-            daily_log = sheets['Daily Lead Log']
+            daily_log = sheets[LEAD_LOG_SHEET]
+            
+            # Polls the background ingest only while it is running
+            indexing_running = not crm.index_ready()
+            with indexing:
+                st.fragment(render_indexing_status, run_every=INDEXING_REFRESH_SECONDS if indexing_running else None)(
+                    crm, uploaded_file, indexing_running
+                )
             
             # Sales Rep Selection
             sales_reps = daily_log['Sales Rep'].unique()
@@ -629,10 +2656,13 @@ def main():
                         """, unsafe_allow_html=True)
             
             # Main Tabs
-            tab1, tab2, tab3 = st.tabs(["AI Sales Coach", "Message Generator", "Manager Report"])
+            tab1, tab2, tab3, tab4, tab5 = st.tabs(
+                ["AI Sales Coach", "Message Generator", "Manager Report", "Team Overview", "Lead Search"]
+            )
             
             with tab1:
                 st.subheader("AI Sales Coach")
+                coach_ready = indexing_notice(crm, "the coach")
                 
                 col1, col2 = st.columns([2, 1])
                 
@@ -646,25 +2676,40 @@ def main():
                 with col2:
                     st.write("")  # Spacing
                     st.write("")
-                    if st.button("Get Coach Advice", type="primary", use_container_width=True):
+                    force_coach = st.checkbox("Force regenerate", key="force_coach",
+                                              help="Skip the response cache and ask Gemini again")
+                    if st.button("Get Coach Advice", type="primary", use_container_width=True, disabled=not coach_ready):
                         if coach_query:
                             with st.spinner("🧠 Analyzing your pipeline and crafting advice..."):
-                                response = crm.sales_coach_chat(coach_query, daily_log, selected_rep)
+                                response = crm.sales_coach_chat(
+                                    coach_query, daily_log, selected_rep, force=force_coach, stream=True
+                                )
                             st.markdown("### Coach's Advice")
-                            st.markdown(f'<div class="coach-advice">{response}</div>', unsafe_allow_html=True)
+                            render_response(response, "coach-advice")
                         else:
                             st.warning("Please enter your question")
                     
                     if st.button("Get Today's Priorities", use_container_width=True):
                         with st.spinner("🔍 Analyzing your pipeline for today's focus areas..."):
-                            analysis = crm.analyze_with_ai(daily_log, selected_rep)
+                            analysis = crm.analyze_with_ai(daily_log, selected_rep, force=force_coach, stream=True)
                         st.markdown("### Today's Action Plan")
-                        st.markdown(f'<div class="report-section">{analysis}</div>', unsafe_allow_html=True)
+                        render_response(analysis, "report-section")
+                
+                overdue = crm.overdue_leads(daily_log, selected_rep)
+                with st.expander(f"⏰ Overdue follow-ups ({len(overdue)})"):
+                    if overdue.empty:
+                        st.success("Nothing overdue - you're on top of your pipeline!")
+                    else:
+                        st.dataframe(
+                            overdue[['Name', 'Company', 'Status Stage', 'Next Step', 'Due Date',
+                                     'Days Overdue', 'Priority', 'Deal Value', 'Lead Score']],
+                            hide_index=True, use_container_width=True
+                        )
             
             with tab2:
                 st.subheader("Smart Message Generator")
                 
-                rep_leads = daily_log[daily_log['Sales Rep'] == selected_rep]
+                rep_leads = crm.rep_slice(daily_log, selected_rep)
                 if not rep_leads.empty:
                     col1, col2 = st.columns(2)
                     
@@ -692,6 +2737,8 @@ def main():
                         info_cols[1].write(f"**Title:** {lead_data['Title']}")
                         info_cols[2].write(f"**Status:** {lead_data.get('Status Stage', 'N/A')}")
                         
+                        force_message = st.checkbox("Force regenerate", key="force_message",
+                                                    help="Skip the response cache and ask Gemini again")
                         if st.button("Generate Message", type="primary"):
                             type_map = {
                                 "Connection Message": "connection",
@@ -700,10 +2747,12 @@ def main():
                             }
                             
                             with st.spinner("✍️ Crafting your message..."):
-                                message = crm.generate_followup_message(lead_data, type_map.get(msg_type, "default"))
+                                message = crm.generate_followup_message(
+                                    lead_data, type_map.get(msg_type, "default"), force=force_message, stream=True
+                                )
                             
                             st.markdown("#### Generated Message")
-                            st.markdown(f'<div class="message-preview">{message}</div>', unsafe_allow_html=True)
+                            message = render_response(message, "message-preview")
                             
                             # Message actions
                             action_cols = st.columns(2)
@@ -731,17 +2780,21 @@ def main():
                 with col2:
                     end_date = st.date_input("End Date", datetime.today())
                 
+                force_report = st.checkbox("Force regenerate", key="force_report",
+                                           help="Skip the response cache and ask Gemini again")
                 if st.button("Generate Manager Report", type="primary"):
                     with st.spinner("📊 Generating comprehensive performance report..."):
                         report = crm.generate_manager_report(
                             daily_log, 
                             selected_rep, 
                             start_date.strftime('%Y-%m-%d'), 
-                            end_date.strftime('%Y-%m-%d')
+                            end_date.strftime('%Y-%m-%d'),
+                            force=force_report,
+                            stream=True
                         )
                     
                     st.markdown("#### Generated Report")
-                    st.markdown(f'<div class="report-section">{report}</div>', unsafe_allow_html=True)
+                    report = render_response(report, "report-section")
                     
                     # WhatsApp Integration
                     st.markdown("---")
@@ -757,6 +2810,88 @@ def main():
                     *This will open WhatsApp with the report pre-filled and ready to send*
                     """)
     
+            with tab4:
+                st.subheader("Team Leaderboard")
+                
+                team = crm.get_team_performance(daily_log)
+                st.dataframe(team['reps'], use_container_width=True)
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.markdown("#### By Source")
+                    st.dataframe(team['sources'], use_container_width=True)
+                with col2:
+                    st.markdown("#### By Stage")
+                    st.dataframe(team['stages'], use_container_width=True)
+                
+                if indexing_notice(crm, "duplicate detection"):
+                    duplicates = crm.find_duplicates(daily_log)
+                    merged_count = st.session_state.pop('merged_duplicates', None)
+                    if merged_count is not None:
+                        st.success(f"Removed {merged_count} duplicate leads from the search index")
+                    with st.expander(f"🔁 Possible duplicate leads ({len(duplicates)})"):
+                        if duplicates.empty:
+                            st.success("No likely duplicates found")
+                        else:
+                            st.caption("Tick the pairs that are the same lead; Lead B is removed from the search index on merge.")
+                            review = st.data_editor(
+                                duplicates.assign(Merge=False),
+                                column_order=['Merge', 'Lead A', 'Company A', 'Rep A', 'Lead B', 'Company B', 'Rep B',
+                                              'Similarity'],
+                                disabled=list(duplicates.columns),
+                                hide_index=True, use_container_width=True, key="duplicate_review"
+                            )
+                            merged = review[review['Merge']]
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if st.button("Merge selected", disabled=merged.empty, use_container_width=True):
+                                    st.session_state.merged_duplicates = crm.remove_leads(merged['Lead B ID'])
+                                    # Ticks are kept by row position, so they must not carry over to the new pairs
+                                    st.session_state.pop("duplicate_review", None)
+                                    st.rerun()
+                            with col2:
+                                st.download_button("Download review (CSV)", review.to_csv(index=False),
+                                                   file_name="duplicate_review.csv", use_container_width=True)
+            
+            with tab5:
+                st.subheader("Lead Search")
+                
+                search_query = st.text_input("Search leads", placeholder="e.g. pricing concerns at fintech companies")
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    search_reps = st.multiselect("Sales Rep", sales_reps, default=[selected_rep])
+                with col2:
+                    search_stages = st.multiselect("Status Stage", daily_log['Status Stage'].dropna().unique())
+                with col3:
+                    search_sources = st.multiselect("Source", daily_log['Source'].dropna().unique())
+                with col4:
+                    search_priorities = st.multiselect("Priority", daily_log['Priority'].dropna().unique())
+                due_range = st.date_input("Due between", value=(), help="Leave empty to include every due date")
+                
+                if indexing_notice(crm, "search"):
+                    started = time.perf_counter()
+                    results = crm.search_leads(
+                        daily_log, search_query,
+                        filters={'sales_rep': search_reps, 'status_stage': search_stages,
+                                 'source': search_sources, 'priority': search_priorities},
+                        due_from=due_range[0] if len(due_range) > 0 else None,
+                        due_to=due_range[1] if len(due_range) > 1 else None,
+                    )
+                    st.caption(f"{len(results)} leads in {(time.perf_counter() - started) * 1000:.0f} ms")
+                    st.dataframe(
+                        results[['Name', 'Company', 'Title', 'Status Stage', 'Priority', 'Next Step', 'Due Date',
+                                 'Deal Value', 'Sales Rep', 'Notes', 'Relevance']],
+                        hide_index=True, use_container_width=True
+                    )
+        
+        # Filled last so the counters include this rerun's generations
+        cache_stats.caption(
+            f"Response cache: {crm.response_cache.hits} hits / {crm.response_cache.misses} misses"
+        )
+        
+        if show_diagnostics:
+            render_diagnostics(diagnostics, crm.telemetry, crm.resources.gateway_stats())
+    
     else:
         # Welcome screen
         st.markdown("""
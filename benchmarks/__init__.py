@@ -0,0 +1 @@
+"""Offline benchmarks for the Sales CRM pipeline; see run_benchmarks.py."""
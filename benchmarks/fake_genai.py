@@ -0,0 +1,53 @@
+"""Offline stand-in for google.genai.Client with configurable latency."""
+import hashlib
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+
+class FakeModels:
+    def __init__(self, embed_latency, generate_latency, dimensions):
+        self.embed_latency = embed_latency
+        self.generate_latency = generate_latency
+        self.dimensions = dimensions
+        self.embed_calls = 0
+        self.generate_calls = 0
+    
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return SimpleNamespace(values=(vector / np.linalg.norm(vector)).tolist())
+    
+    def _response(self, prompt, text):
+        usage = SimpleNamespace(
+            prompt_token_count=len(prompt) // 4,
+            candidates_token_count=len(text) // 4,
+            total_token_count=(len(prompt) + len(text)) // 4,
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage)
+    
+    def embed_content(self, model, contents, config=None):
+        self.embed_calls += 1
+        time.sleep(self.embed_latency)
+        texts = contents if isinstance(contents, list) else [contents]
+        return SimpleNamespace(embeddings=[self._vector(text) for text in texts])
+    
+    def generate_content(self, model, contents, config=None):
+        self.generate_calls += 1
+        time.sleep(self.generate_latency)
+        return self._response(contents, f"Synthetic response to a {len(contents)}-character prompt.")
+    
+    def generate_content_stream(self, model, contents, config=None):
+        self.generate_calls += 1
+        words = f"Synthetic response to a {len(contents)}-character prompt.".split(" ")
+        for word in words:
+            time.sleep(self.generate_latency / len(words))
+            yield self._response(contents, word + " ")
+
+
+class FakeClient:
+    """Deterministic unit-length embeddings and canned text; sleeps stand in for network time"""
+    
+    def __init__(self, embed_latency=0.0, generate_latency=0.0, dimensions=768):
+        self.models = FakeModels(embed_latency, generate_latency, dimensions)
@@ -0,0 +1,216 @@
+"""Repeatable timing and peak-memory benchmarks for the Sales CRM pipeline, fully offline.
+
+    python -m benchmarks.run_benchmarks --sizes 1000 10000 --label before
+    python -m benchmarks.run_benchmarks --sizes 1000 10000 --label after --compare before
+
+Results are saved as JSON under --results-dir so runs can be compared between versions.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Keep benchmark caches away from the app's real cache before app reads its settings
+os.environ["CRM_CACHE_DIR"] = tempfile.mkdtemp(prefix="crm-bench-")
+os.environ.pop("CHROMA_PERSIST_DIR", None)
+
+import pandas as pd  # noqa: E402
+
+import app  # noqa: E402
+from benchmarks.fake_genai import FakeClient  # noqa: E402
+from benchmarks.synthetic_tracker import generate_tracker  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+class BenchTracker(app.TrackerFile):
+    """In-memory tracker that looks like the same Streamlit upload on every rerun"""
+    
+    def __init__(self, data, name):
+        app.io.BytesIO.__init__(self, data)
+        self.name = name
+        self.file_id = "bench"
+
+
+def measure(fn, repeat):
+    """Median and best wall time over `repeat` runs, plus peak traced memory from one extra run"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'median_s': statistics.median(timings),
+        'min_s': min(timings),
+        'peak_mb': peak / 1024 / 1024,
+    }
+
+
+def fresh_crm(client):
+    # Each ingest run starts from an empty cache and an empty collection
+    app.CACHE_DIR = tempfile.mkdtemp(prefix="crm-bench-")
+    crm = app.SalesCRM(client=client)
+    try:
+        crm.chroma_client.delete_collection(crm.collection.name)
+    except Exception:
+        pass
+    crm.setup_vector_db()
+    return crm
+
+
+def run_size(rows, args):
+    df = generate_tracker(rows, reps=args.reps, seed=args.seed)
+    data = df.to_csv(index=False).encode('utf-8')
+    client = FakeClient(embed_latency=args.embed_latency, generate_latency=args.generate_latency)
+    crm = app.SalesCRM(client=client)
+    tracker = BenchTracker(data, f"bench_{rows}.csv")
+    
+    file_hash, sheets = crm.parse_tracker(tracker)
+    daily_log = sheets[app.LEAD_LOG_SHEET]
+    reps = [str(rep) for rep in daily_log['Sales Rep'].dropna().unique()]
+    start_date, end_date = '2024-06-01', '2024-06-30'
+    results = {}
+    
+    def parse():
+        app.read_workbook(data, tracker.name, crm.activity_rules)
+    
+    def snapshot():
+        # parse_tracker above already wrote this upload's snapshot
+        app.read_workbook(data, tracker.name, crm.activity_rules, file_hash)
+    
+    def metrics():
+        crm._team_performance = None
+        for rep in reps:
+            crm.get_rep_performance(daily_log, rep)
+        crm.get_team_performance(daily_log)
+    
+    def report_filter():
+        for rep in reps:
+            crm.generate_manager_report(daily_log, rep, start_date, end_date, force=True)
+    
+    def prompts():
+        for rep in reps[:5]:
+            crm.analyze_with_ai(crm.rep_slice(daily_log, rep), rep, force=True)
+            crm.sales_coach_chat("Which leads should I follow up with today?", daily_log, rep, force=True)
+    
+    def rerun():
+        # What a widget change costs: reuse the parsed upload and redraw the dashboard
+        _, rerun_sheets = crm.parse_tracker(tracker)
+        rerun_log = rerun_sheets[app.LEAD_LOG_SHEET]
+        crm.get_rep_performance(rerun_log, reps[0])
+        crm.rep_slice(rerun_log, reps[0])['Name'].unique()
+        crm.get_team_performance(rerun_log)
+    
+    results['parse'] = measure(parse, args.repeat)
+    if app.SNAPSHOTS_ENABLED:
+        results['snapshot'] = measure(snapshot, args.repeat)
+    results['metrics'] = measure(metrics, args.repeat)
+    results['report_filter'] = measure(report_filter, args.repeat)
+    
+    if rows <= args.ingest_max_rows:
+        def ingest():
+            fresh_crm(client).store_leads_in_db(daily_log)
+        results['ingest'] = measure(ingest, max(1, args.repeat // 2))
+        # Prompt builders query the vector store, so give them a populated one. The in-memory
+        # Chroma client is shared per process, so reattach after fresh_crm dropped the collection
+        crm.setup_vector_db()
+        crm.lead_snapshot = None
+        crm.store_leads_in_db(daily_log)
+        crm.ingested_file_hash = crm.parse_tracker(tracker)[0]
+        results['prompts'] = measure(prompts, args.repeat)
+    
+    results['rerun'] = measure(rerun, args.repeat)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print a side-by-side table and return the scenarios that slowed down by more than threshold"""
+    regressions = []
+    print(f"\n{'size':>9} {'scenario':<14} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for size, scenarios in current['sizes'].items():
+        for scenario, result in scenarios.items():
+            before = baseline['sizes'].get(size, {}).get(scenario)
+            if not before:
+                continue
+            ratio = result['median_s'] / max(before['median_s'], 1e-9)
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions.append((size, scenario, ratio))
+            print(f"{size:>9} {scenario:<14} {before['median_s']:>9.4f}s {result['median_s']:>9.4f}s "
+                  f"{ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Sales CRM benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="Tracker sizes in rows (default: 1000 10000 100000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per scenario (default: 3)")
+    parser.add_argument("--reps", type=int, default=30, help="Sales reps in the synthetic tracker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ingest-max-rows", type=int, default=10_000,
+                        help="Skip vector-store scenarios above this size (default: 10000)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per fake embed request")
+    parser.add_argument("--generate-latency", type=float, default=0.0, help="Seconds per fake generation")
+    parser.add_argument("--label", default=datetime.now().strftime('%Y%m%d-%H%M%S'))
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--compare", help="Label of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown ratio above which a scenario counts as a regression (default: 0.2)")
+    args = parser.parse_args(argv)
+    
+    report = {
+        'label': args.label,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'settings': {key: value for key, value in vars(args).items() if key not in ('compare', 'results_dir')},
+        'sizes': {},
+    }
+    for rows in args.sizes:
+        print(f"Benchmarking {rows} rows...", flush=True)
+        results = run_size(rows, args)
+        report['sizes'][str(rows)] = results
+        for scenario, result in results.items():
+            print(f"  {scenario:<14} median {result['median_s']:.4f}s  best {result['min_s']:.4f}s  "
+                  f"peak {result['peak_mb']:.1f} MB")
+    
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"{args.label}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {path}")
+    
+    if args.compare:
+        with open(os.path.join(args.results_dir, f"{args.compare}.json"), encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Cold-start timing: how long a fresh interpreter takes to import app and build a session's SalesCRM.
+
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --importtime 15
+
+Each run is a new process, so nothing is warm except the OS file cache. The heavy modules that
+ended up loaded are listed, which shows when a change pulls one back onto the cold-start path.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HEAVY_MODULES = ['pandas', 'numpy', 'chromadb', 'google.genai', 'pyarrow']
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.SalesCRM(resources=app.SharedResources())
+ready = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - started,
+    'ready_s': ready - started,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def probe_env():
+    # A placeholder key passes the startup check; no request is ever made
+    env = dict(os.environ, GOOGLE_API_KEY=os.environ.get("GOOGLE_API_KEY", "startup-probe"),
+               CRM_CACHE_DIR=tempfile.mkdtemp(prefix="crm-startup-"))
+    env.pop("CHROMA_PERSIST_DIR", None)
+    return env
+
+
+def run_probe(importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE]
+    result = subprocess.run(command, capture_output=True, text=True, check=True, env=probe_env(),
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    """Top modules by cumulative import time from `python -X importtime` output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Sales CRM cold-start time")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes to time (default: 5)")
+    parser.add_argument("--importtime", type=int, metavar="N", default=0,
+                        help="Also list the N slowest imports of one run")
+    args = parser.parse_args(argv)
+
+    runs = [run_probe()[0] for _ in range(args.repeat)]
+    print(f"import app     median {statistics.median(run['import_s'] for run in runs):.3f}s  "
+          f"best {min(run['import_s'] for run in runs):.3f}s")
+    print(f"session ready  median {statistics.median(run['ready_s'] for run in runs):.3f}s  "
+          f"best {min(run['ready_s'] for run in runs):.3f}s")
+    print(f"heavy modules loaded: {', '.join(runs[-1]['loaded']) or 'none'}")
+
+    if args.importtime:
+        _, stderr = run_probe(importtime=True)
+        print(f"\n{'cumulative':>12}  module")
+        for microseconds, name in slowest_imports(stderr, args.importtime):
+            print(f"{microseconds / 1000:>10.1f}ms  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Synthetic trackers with the same 17-column Daily Lead Log schema as crm_ready_leads_tracker.xlsx.
+
+    python -m benchmarks.synthetic_tracker --rows 100000 --out leads_100k.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+FIRST_NAMES = ['Suresh', 'Amit', 'Priya', 'Karan', 'Tanya', 'Arjun', 'Rohan', 'Deepak', 'Meena', 'Divya',
+               'Ankit', 'Aditya', 'Sneha', 'Nikhil', 'Ritika', 'Rajesh', 'Pooja', 'Vikram', 'Kavya']
+LAST_NAMES = ['Reddy', 'Patel', 'Singh', 'Arora', 'Rao', 'Mehta', 'Sharma', 'Joseph', 'Kapoor', 'Yadav',
+              'Menon', 'Nair', 'Jain', 'Verma', 'Kumar', 'Das', 'Iyer']
+COMPANIES = ['Growthify', 'CodeAxis', 'MarketLeap', 'Saleslytics', 'EnterpriseSoft', 'DataCorp', 'TechSolutions',
+             'SoftHub', 'FinGrow', 'StartupXYZ', 'CloudTech India', 'InfoMatrix', 'NeoTech Labs', 'NextWave', 'BizNex']
+TITLES = ['Marketing Head', 'CTO', 'IT Manager', 'VP Sales', 'Growth Head', 'Business Analyst', 'Founder',
+          'Sales Director', 'Product Manager', 'CEO']
+SOURCES = ['LinkedIn Sales Nav', 'Reference', 'Direct Approach', 'Gmail Campaign', 'WhatsApp Referral']
+# Action Taken -> Next Step, as in the workbook's 'Action Reference' sheet
+ACTIONS = {
+    'Sent connection request': 'Send welcome message (when connected)',
+    'Sent welcome message': 'Send engagement message',
+    'Sent engagement message': 'Send value message',
+    'Sent value message': 'Send closing message',
+    'Sent closing message': 'Schedule call or follow up',
+    'Had discovery call': 'Send proposal',
+    'Sent proposal': 'Follow up',
+    'Followed up': 'Send contract or nurture',
+    'Call scheduled': 'Prepare for demo',
+    'Connection accepted': 'Send case study',
+}
+STAGES = ['New', 'Contacted', 'Engaged', 'Proposal Sent', 'Closed Won', 'Closed Lost']
+STAGE_WEIGHTS = [0.15, 0.27, 0.38, 0.12, 0.05, 0.03]
+NOTES = ['Budget discussion pending', 'Compare with 2 vendors', 'Reference provided', 'Price sensitive',
+         'Technical evaluation needed', 'Waiting for reply', 'Decision maker', 'Startup budget',
+         'Quick responder', 'Needs pricing details', 'High-value prospect', 'Follow-up required',
+         'Multiple stakeholders']
+PRIORITIES = ['High', 'Medium', 'Low']
+
+
+def generate_tracker(rows, reps=30, seed=0, start_date='2024-01-01', days=730):
+    """Daily Lead Log frame with `rows` rows spread across `reps` sales reps"""
+    rng = np.random.default_rng(seed)
+    first = rng.choice(FIRST_NAMES, rows)
+    last = rng.choice(LAST_NAMES, rows)
+    company = rng.choice(COMPANIES, rows)
+    actions = rng.choice(list(ACTIONS), rows)
+    stages = rng.choice(STAGES, rows, p=STAGE_WEIGHTS)
+    
+    action_date = pd.Timestamp(start_date) + pd.to_timedelta(rng.integers(0, days, rows), unit='D')
+    last_contact = action_date + pd.to_timedelta(rng.integers(0, 5, rows), unit='D')
+    due_date = last_contact + pd.to_timedelta(rng.integers(1, 7, rows), unit='D')
+    
+    names = pd.Series(first) + ' ' + pd.Series(last)
+    slug = pd.Series(first).str.lower() + '.' + pd.Series(last).str.lower() + pd.Series(np.arange(rows)).astype(str)
+    domain = pd.Series(company).str.lower().str.replace(' ', '', regex=False) + '.com'
+    has_value = np.isin(stages, ['Engaged', 'Proposal Sent', 'Closed Won'])
+    
+    return pd.DataFrame({
+        'Name': names,
+        'Company': company,
+        'Title': rng.choice(TITLES, rows),
+        'Email': slug + '@' + domain,
+        'Phone': ['+91 ' + str(number) for number in rng.integers(7_000_000_000, 9_999_999_999, rows)],
+        'LinkedIn URL': 'linkedin.com/in/' + slug,
+        'Source': rng.choice(SOURCES, rows),
+        'Action Taken': actions,
+        'Action Date': action_date.strftime('%Y-%m-%d'),
+        'Last Contact Date': last_contact.strftime('%Y-%m-%d'),
+        'Next Step': pd.Series(actions).map(ACTIONS),
+        'Due Date': due_date.strftime('%Y-%m-%d'),
+        'Status Stage': stages,
+        'Sales Rep': [f"Rep {number:03d}" for number in rng.integers(1, reps + 1, rows)],
+        'Notes': rng.choice(NOTES, rows),
+        'Deal Value': np.where(has_value, rng.uniform(5_000, 150_000, rows).round(2), 0.0),
+        'Priority': rng.choice(PRIORITIES, rows),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic lead tracker")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--reps", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="Output .csv or .xlsx path")
+    args = parser.parse_args()
+    
+    df = generate_tracker(args.rows, reps=args.reps, seed=args.seed)
+    if args.out.endswith('.xlsx'):
+        df.to_excel(args.out, sheet_name='Daily Lead Log', index=False)
+    else:
+        df.to_csv(args.out, index=False)
+    print(f"Wrote {len(df)} rows to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Headless entry point for nightly ingestion and manager reports.
+
+    python cli.py ingest crm_ready_leads_tracker.xlsx
+    python cli.py ingest lead_export.csv --stream --chunk-size 5000
+    python cli.py reports crm_ready_leads_tracker.xlsx --start 2025-10-01 --end 2025-10-31
+    python cli.py nightly crm_ready_leads_tracker.xlsx --workers 8 --max-concurrency 4
+
+`ingest` and `nightly` write to the vector store in CHROMA_PERSIST_DIR, which must be set and
+must be the same directory the Streamlit app is started with; otherwise the app never sees
+what was ingested. --ephemeral runs them against a throwaway in-memory store instead.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from app import CHROMA_PERSIST_DIR, INGEST_CHUNK_SIZE, LEAD_LOG_SHEET, SalesCRM, TrackerFile, format_ingest_summary
+
+
+def ingest(crm, tracker):
+    sheets, summary = crm.ingest_tracker(tracker, on_progress=print)
+    if summary:
+        for error in summary['errors']:
+            print(error, file=sys.stderr)
+        print(format_ingest_summary(summary))
+    return sheets, summary
+
+
+def stream_ingest(crm, path, chunk_size):
+    summary = crm.stream_ingest_csv(path, chunk_size=chunk_size, on_progress=print)
+    if summary['resumed_from']:
+        print(f"Resumed after row {summary['resumed_from']}")
+    for error in summary['errors']:
+        print(error, file=sys.stderr)
+    print(format_ingest_summary(summary))
+    return summary
+
+
+def write_reports(crm, daily_log, reps, start_date, end_date, out_dir, workers, force=False):
+    """Generate one manager report per rep in parallel and write each to out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    failed = []
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(crm.generate_manager_report, daily_log, rep, start_date, end_date, force=force): rep
+            for rep in reps
+        }
+        for future in as_completed(futures):
+            rep = futures[future]
+            report = future.result()
+            file_name = "".join(c if c.isalnum() else "_" for c in rep) + ".txt"
+            path = os.path.join(out_dir, file_name)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(report)
+            
+            if report.startswith("Report generation error"):
+                failed.append(rep)
+                print(f"{rep}: FAILED ({path})", file=sys.stderr)
+            else:
+                print(f"{rep}: {path}")
+    
+    return failed
+
+
+def parse_args(argv=None):
+    today = datetime.today()
+    parser = argparse.ArgumentParser(description="Sales CRM batch jobs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    ingest_parser = subparsers.add_parser("ingest", help="Sync a tracker into the vector database")
+    ingest_parser.add_argument("tracker", help="CSV or Excel tracker file")
+    ingest_parser.add_argument("--stream", action="store_true",
+                               help="Read a CSV export in chunks with bounded memory; resumes if interrupted")
+    ingest_parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE,
+                               help=f"Rows per chunk when streaming (default: {INGEST_CHUNK_SIZE})")
+    ingest_parser.add_argument("--ephemeral", action="store_true",
+                               help="Allow ingesting into an in-memory store that is lost on exit")
+    
+    for name, help_text in [
+        ("reports", "Write manager reports for every sales rep"),
+        ("nightly", "Ingest a tracker, then write manager reports for every sales rep"),
+    ]:
+        report_parser = subparsers.add_parser(name, help=help_text)
+        report_parser.add_argument("tracker", help="CSV or Excel tracker file")
+        report_parser.add_argument("--start", default=(today - timedelta(days=7)).strftime('%Y-%m-%d'),
+                                   help="First day of the report window (YYYY-MM-DD, default: 7 days ago)")
+        report_parser.add_argument("--end", default=today.strftime('%Y-%m-%d'),
+                                   help="Last day of the report window (YYYY-MM-DD, default: today)")
+        report_parser.add_argument("--reps", nargs="+", help="Only these sales reps (default: all)")
+        report_parser.add_argument("--out", default="reports", help="Output directory (default: reports)")
+        report_parser.add_argument("--workers", type=int, default=4, help="Report worker threads (default: 4)")
+        report_parser.add_argument("--max-concurrency", type=int, default=2,
+                                   help="Gemini requests in flight at once (default: 2)")
+        report_parser.add_argument("--force", action="store_true", help="Skip the response cache")
+        if name == "nightly":
+            report_parser.add_argument("--ephemeral", action="store_true",
+                                       help="Allow ingesting into an in-memory store that is lost on exit")
+    
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    if args.command in ("ingest", "nightly") and not CHROMA_PERSIST_DIR and not args.ephemeral:
+        print("CHROMA_PERSIST_DIR is not set, so the ingested leads would be lost when this process exits. "
+              "Set it to the directory the app uses, or pass --ephemeral.", file=sys.stderr)
+        return 2
+    
+    try:
+        crm = SalesCRM(max_concurrent_generations=getattr(args, 'max_concurrency', None))
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 2
+    
+    if args.command == "ingest" and args.stream:
+        if not args.tracker.endswith('.csv'):
+            print("Streaming ingestion only supports CSV files", file=sys.stderr)
+            return 2
+        summary = stream_ingest(crm, args.tracker, args.chunk_size)
+        return 1 if summary['failed'] else 0
+    
+    tracker = TrackerFile(args.tracker)
+    if args.command == "reports":
+        _, sheets = crm.parse_tracker(tracker)
+    else:
+        sheets, _ = ingest(crm, tracker)
+    if args.command == "ingest":
+        return 0
+    
+    daily_log = sheets[LEAD_LOG_SHEET]
+    reps = args.reps or [str(rep) for rep in daily_log['Sales Rep'].dropna().unique()]
+    out_dir = os.path.join(args.out, f"{args.start}_to_{args.end}")
+    failed = write_reports(crm, daily_log, reps, args.start, args.end, out_dir, args.workers, force=args.force)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())